@@ -1,10 +1,10 @@
 #!/usr/bin/env python3
 import math
+from array import array
 
 from PIL import Image
 
-# NO ADDITIONAL IMPORTS!
-# (except in the last part of the lab; see the lab writeup for details)
+# Standard library imports only, plus PIL for loading and saving images.
 
 
 # COPIED FROM LAB1 >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>
@@ -256,25 +256,96 @@ def filter_cascade(filters):
 
 # Main Seam Carving Implementation
 
-def seam_carving(image, ncols):
+def seam_carving(image, ncols, mask=None, energy_function=None):
     """
     Starting from the given image, use the seam carving technique to remove
     ncols (an integer) columns from the image.
+
+    mask, if given, is a greyscale-style image (same height and width) whose
+    pixel values are added to the energy before each seam is found.  Large
+    positive weights protect pixels (e.g. faces or logos), negative weights
+    attract seams.  The mask is carved along with the image, so it only has to
+    be supplied once.
+
+    energy_function, if given, is used in place of compute_energy (for
+    example, the multi-process backend in parallel_energy.py).
     """
     result = {"height": image["height"],
               "width": image["width"],
               "pixels": image["pixels"].copy()}
 
+    if mask is not None:
+        mask = {"height": mask["height"],
+                "width": mask["width"],
+                "pixels": mask["pixels"].copy()}
+
+    # the greyscale plane is carved alongside the image instead of being
+    # recomputed from the color image on every pass
+    grey = greyscale_image_from_color_image(result)
+
     for _ in range(ncols):
-        grey = greyscale_image_from_color_image(result)
-        edges = compute_energy(grey)
-        cem = cumulative_energy_map(edges)
-        seam = minimum_energy_seam(cem)
-        result = image_without_seam(result, seam)
+        result, grey, mask = carve_one_seam(result, grey, mask, energy_function)
+
+    return result
+
+
+def remove_object(image, mask):
+    """
+    Remove an object from the given color image by repeatedly carving seams
+    through it.
+
+    mask is a greyscale-style image of weights: pixels with negative values
+    mark the object to remove, pixels with positive values are protected and
+    zero means no preference.  Object pixels are weighted so heavily that the
+    minimum-energy seam always passes through as many of them as it can, so
+    the number of passes is bounded by the width of the object rather than
+    the width of the image.
+
+    Returns a new image, narrower than the original by the number of seams
+    that were needed.
+    """
+    bias = -(image["height"] * 255 + 1)
+
+    result = {"height": image["height"],
+              "width": image["width"],
+              "pixels": image["pixels"].copy()}
+    mask = {"height": mask["height"],
+            "width": mask["width"],
+            "pixels": [bias if m < 0 else m for m in mask["pixels"]]}
+
+    grey = greyscale_image_from_color_image(result)
+
+    while result["width"] > 1 and any(m < 0 for m in mask["pixels"]):
+        result, grey, mask = carve_one_seam(result, grey, mask)
 
     return result
 
 
+def carve_one_seam(image, grey, mask=None, energy_function=None):
+    """
+    Remove a single minimum-energy seam from the given color image, whose
+    greyscale version is grey.
+
+    If mask is given, it is added to the energy before the seam is chosen, and
+    the same seam is removed from it as well.  energy_function, if given, is
+    used in place of compute_energy.
+
+    Returns a tuple (image, grey, mask) of the carved image, carved greyscale
+    image and carved mask (or None if no mask was given).
+    """
+    energy = (energy_function or compute_energy)(grey)
+
+    if mask is not None:
+        energy = apply_energy_mask(energy, mask)
+
+    seam = seam_from_backpointers(*energy_backpointers(energy))
+
+    if mask is not None:
+        mask = image_without_seam(mask, seam)
+
+    return image_without_seam(image, seam), image_without_seam(grey, seam), mask
+
+
 # Optional Helper Functions for Seam Carving
 
 def greyscale_image_from_color_image(image):
@@ -286,21 +357,74 @@ def greyscale_image_from_color_image(image):
     result = {"height": image["height"],
               "width": image["width"]}
 
-    result["pixels"] = [round(0.299 * r + 0.587 * g + 0.114 * b)
-                        for r, g, b in image["pixels"]]
+    result["pixels"] = greyscale_pixels(image["pixels"])
 
     return result
 
 
+def greyscale_pixels(pixels):
+    """
+    Given a list of (r, g, b) pixels, returns the list of their greyscale
+    values.
+    """
+    return [round(0.299 * r + 0.587 * g + 0.114 * b) for r, g, b in pixels]
+
+
 def compute_energy(grey):
     """
-    Given a greyscale image, computes a measure of "energy", in our case using
-    the edges function from last week.
+    Given a greyscale image, computes a measure of "energy", in our case the
+    same values as the edges function from last week, but in a single pass
+    over the rows of the image.
 
     Returns a greyscale image (represented as a dictionary).
     """
+    height, width = grey["height"], grey["width"]
+    pixels = grey["pixels"]
+    rows = [pixels[x * width:(x + 1) * width] for x in range(height)]
 
-    return edges(grey)
+    result = {"height": height, "width": width, "pixels": []}
+
+    for x in range(height):
+        above = rows[max(x - 1, 0)]
+        below = rows[min(x + 1, height - 1)]
+        result["pixels"].extend(sobel_row(above, rows[x], below))
+
+    return result
+
+
+def sobel_row(above, row, below):
+    """
+    Given three consecutive rows of a greyscale image, returns the energy of
+    the middle row: the magnitude of the Sobel gradient, rounded and clipped
+    to [0, 255].  Pixels past either end of a row take the value of the edge
+    pixel, as in get_pixel.
+    """
+    def shifted(r):
+        return r[:1] + r[:-1], r[1:] + r[-1:]
+
+    (a_l, a_r), (r_l, r_r), (b_l, b_r) = shifted(above), shifted(row), shifted(below)
+
+    out = []
+
+    for al, a, ar, rl, rr, bl, b, br in zip(a_l, above, a_r, r_l, r_r, b_l, below, b_r):
+        gx = (ar - al) + 2 * (rr - rl) + (br - bl)
+        gy = (bl + 2 * b + br) - (al + 2 * a + ar)
+        out.append(min(round((gx**2 + gy**2)**(1/2)), 255))
+
+    return out
+
+
+def apply_energy_mask(energy, mask):
+    """
+    Given an energy image and a weight mask of the same size, returns a new
+    energy image with the mask's values added pixel by pixel.
+    """
+    assert (energy["height"], energy["width"]) == (mask["height"], mask["width"]), \
+        "mask must have the same size as the image"
+
+    return {"height": energy["height"],
+            "width": energy["width"],
+            "pixels": [e + m for e, m in zip(energy["pixels"], mask["pixels"])]}
 
 
 def cumulative_energy_map(energy):
@@ -312,24 +436,42 @@ def cumulative_energy_map(energy):
     the values in the 'pixels' array may not necessarily be in the range [0,
     255].
     """
+    width = energy["width"]
+    pixels = energy["pixels"]
+
+    prev = pixels[:width]
     result = {"height": energy["height"],
-              "width": energy["width"],
-              "pixels": []}
+              "width": width,
+              "pixels": list(prev)}
 
-    for h in range(energy["height"]):
-        for w in range(energy["width"]):
-            val1 = get_pixel(energy, h, w)
+    for start in range(width, len(pixels), width):
+        prev = [e + min(l, c, r) for e, l, c, r in
+                zip(pixels[start:start + width], *shifted_rows(prev))]
+        result["pixels"].extend(prev)
 
-            if h == 0:
-                val2 = 0
-            else:
-                val2 = min(get_pixel(result, h - 1, w - 1),
-                           get_pixel(result, h - 1, w),
-                           get_pixel(result, h - 1, w + 1))
+    return result
 
-            result["pixels"].append(val1 + val2)
 
-    return result
+def shifted_rows(row):
+    """
+    Given a row of values, returns (left, row, right), where left[w] and
+    right[w] are the values at w - 1 and w + 1 in row.  Positions that fall
+    off either end of the row are filled with infinity, so they never win a
+    minimum.
+    """
+    inf = float("inf")
+
+    return [inf] + row[:-1], row, row[1:] + [inf]
+
+
+def leftmost_min_col(row, lo, hi):
+    """
+    Returns the index of the smallest value in row[lo:hi] (clipped to the
+    bounds of row), preferring the leftmost one in case of ties.
+    """
+    lo, hi = max(lo, 0), min(hi, len(row))
+
+    return min(range(lo, hi), key=row.__getitem__)
 
 
 def minimum_energy_seam(cem):
@@ -338,36 +480,80 @@ def minimum_energy_seam(cem):
     'pixels' list that correspond to pixels contained in the minimum-energy
     seam (computed as described in the lab 2 writeup).
     """
-    def append_min(part_row):
-        min_val = 1e10
+    width = cem["width"]
+    pixels = cem["pixels"]
 
-        for w in part_row:
-            if w <= 0:
-                w = 0
-            elif w >= cem["width"]:
-                w = cem["width"] - 1
+    start = len(pixels) - width
+    col = leftmost_min_col(pixels[start:], 0, width)
+    seam = [start + col]
 
-            if get_pixel(cem, h, w) < min_val:
-                min_val = get_pixel(cem, h, w)
-                min_idx = (h, w)
-        indices.append(min_idx)
+    for start in range(start - width, -1, -width):
+        col = leftmost_min_col(pixels[start:start + width], col - 1, col + 2)
+        seam.append(start + col)
 
-        return min_idx
+    seam.reverse()
 
-    indices = []
+    return seam
 
-    for h in reversed(range(cem["height"])):
-        # find minimum value of last row
 
-        if h == cem["height"] - 1:
-            min_idx = append_min(range(cem["width"]))
-        else:
-            # get adjacents
-            adjs = [min_idx[1] + t for t in [-1, 0, 1]]
-            min_idx = append_min(adjs)
-    indices.reverse()
+def energy_backpointers(energy):
+    """
+    Runs the cumulative energy dynamic program over the given energy image
+    while only keeping two rows of the cumulative map in memory.
 
-    return indices
+    Returns a tuple (last_row, backpointers), where last_row is the final row
+    of the cumulative energy map and backpointers is an int8 array holding,
+    for every pixel, the column offset (-1, 0 or 1) of the pixel above it on
+    its minimum-energy path.  seam_from_backpointers turns these into the
+    same seam minimum_energy_seam would find.
+    """
+    width = energy["width"]
+    pixels = energy["pixels"]
+
+    prev = pixels[:width]
+    backpointers = array("b", bytes(width))
+
+    for start in range(width, len(pixels), width):
+        row = []
+        offsets = array("b")
+
+        for e, l, c, r in zip(pixels[start:start + width], *shifted_rows(prev)):
+            # ties go to the leftmost neighbor
+            if l <= c and l <= r:
+                row.append(e + l)
+                offsets.append(-1)
+            elif c <= r:
+                row.append(e + c)
+                offsets.append(0)
+            else:
+                row.append(e + r)
+                offsets.append(1)
+
+        backpointers.extend(offsets)
+        prev = row
+
+    return prev, backpointers
+
+
+def seam_from_backpointers(last_row, backpointers):
+    """
+    Given the output of energy_backpointers, returns a list of the indices
+    into the 'pixels' list of the minimum-energy seam.
+    """
+    width = len(last_row)
+
+    start = len(backpointers) - width
+    col = leftmost_min_col(last_row, 0, width)
+    seam = [start + col]
+
+    while start > 0:
+        col += backpointers[start + col]
+        start -= width
+        seam.append(start + col)
+
+    seam.reverse()
+
+    return seam
 
 
 def image_without_seam(image, seam):
@@ -377,21 +563,192 @@ def image_without_seam(image, seam):
     pixels from the original image except those corresponding to the locations
     in the given list.
     """
-    result = {"height": image["height"],
-              "width": image["width"] - 1,
-              "pixels": []}
+    seam = set(seam)
+
+    return {"height": image["height"],
+            "width": image["width"] - 1,
+            "pixels": [p for i, p in enumerate(image["pixels"])
+                       if i not in seam]}
+
+
+# Seam Carving for Video
+
+def carve_frames(frames, ncols, band=4):
+    """
+    Given an iterable of color images (the frames of a video), yields each
+    frame with ncols columns removed by seam carving.
+
+    This is a generator, and only the previous frame is kept around, so
+    memory use does not grow with the length of the video.  Consecutive
+    frames are carved coherently: the k-th seam of each frame is only
+    searched for within band columns of the k-th seam of the previous frame,
+    which avoids flicker and keeps the search small.  Energy is reused
+    wherever it cannot have changed: rows of a frame whose neighborhood is
+    identical to the previous frame keep their energy, and after each seam
+    only the pixels next to the seam are recomputed.  A frame whose size
+    differs from the previous one is carved from scratch.
+    """
+    prev = None
+
+    for frame in frames:
+        height, width = frame["height"], frame["width"]
+        if prev is not None and (prev["height"], prev["width"]) != (height, width):
+            prev = None
+
+        grey, energy = frame_energy(frame, prev)
+        first_grey, first_energy = grey, energy
+
+        image = frame
+        seams = []
+
+        for k in range(ncols):
+            if prev is None:
+                seam = seam_from_backpointers(*energy_backpointers(energy))
+            else:
+                seam = banded_minimum_energy_seam(energy, prev["seams"][k], band)
+
+            cols = [i - x * energy["width"] for x, i in enumerate(seam)]
+            seams.append(cols)
+
+            image = image_without_seam(image, seam)
+            grey = image_without_seam(grey, seam)
+            energy = energy_without_seam(energy, grey, cols)
+
+        prev = {"height": height, "width": width, "pixels": frame["pixels"],
+                "grey": first_grey, "energy": first_energy, "seams": seams}
+
+        yield image
+
+
+def frame_energy(frame, prev=None):
+    """
+    Computes the greyscale version and energy of the given color frame.
+
+    prev, if given, holds the 'pixels', 'grey' and 'energy' of the previous
+    frame (see carve_frames).  Rows whose pixels did not change are not
+    converted to greyscale again, and rows whose three-row neighborhood did
+    not change keep their previous energy.
 
-    count = 0
+    Returns a tuple (grey, energy) of greyscale images.
+    """
+    height, width = frame["height"], frame["width"]
+    pixels = frame["pixels"]
+
+    if prev is None or (prev["height"], prev["width"]) != (height, width):
+        grey = greyscale_image_from_color_image(frame)
+        return grey, compute_energy(grey)
+
+    changed = {x for x in range(height)
+               if pixels[x * width:(x + 1) * width]
+               != prev["pixels"][x * width:(x + 1) * width]}
+
+    grey = {"height": height, "width": width, "pixels": []}
+    for x in range(height):
+        if x in changed:
+            grey["pixels"].extend(greyscale_pixels(pixels[x * width:(x + 1) * width]))
+        else:
+            grey["pixels"].extend(prev["grey"]["pixels"][x * width:(x + 1) * width])
 
-    for h in range(image["height"]):
-        for w in range(image["width"]):
-            if (h, w) not in seam:
-                result["pixels"].append(get_pixel(image, h, w))
-                count += 1
+    energy = {"height": height, "width": width,
+              "pixels": prev["energy"]["pixels"].copy()}
+    dirty = {y for x in changed for y in (x - 1, x, x + 1) if 0 <= y < height}
+    for x in dirty:
+        update_energy_row(energy, grey, x, 0, width - 1)
+
+    return grey, energy
+
+
+def update_energy_row(energy, grey, x, lo, hi):
+    """
+    Recomputes (in place) the energy of row x of the given energy image, in
+    columns lo through hi inclusive, from the corresponding greyscale image.
+    """
+    height, width = grey["height"], grey["width"]
+    lo, hi = max(lo, 0), min(hi, width - 1)
+    if lo > hi:
+        return
+
+    # include one extra column on each side so that the values we keep see
+    # their real neighbors rather than clamped ones
+    a, b = max(lo - 1, 0), min(hi + 2, width)
+
+    def row_slice(r):
+        r = max(min(r, height - 1), 0) * width
+        return grey["pixels"][r + a:r + b]
+
+    values = sobel_row(row_slice(x - 1), row_slice(x), row_slice(x + 1))
+    energy["pixels"][x * width + lo:x * width + hi + 1] = values[lo - a:hi + 1 - a]
+
+
+def energy_without_seam(energy, grey, cols):
+    """
+    Given the energy of an image, the greyscale image after a seam has been
+    removed, and the column of that seam in each row, returns the energy of
+    the carved image.
+
+    Only the pixels whose 3x3 neighborhood touched the seam (two columns to
+    the left and one to the right of it, in the carved image) are recomputed;
+    everything else is copied from the old energy.
+    """
+    width = energy["width"]
+    seam = [x * width + c for x, c in enumerate(cols)]
+    result = image_without_seam(energy, seam)
+
+    for x, c in enumerate(cols):
+        update_energy_row(result, grey, x, c - 2, c + 1)
 
     return result
 
 
+def banded_minimum_energy_seam(energy, guide, band):
+    """
+    Finds the minimum-energy seam of the given energy image among the seams
+    that stay within band columns of guide, a list holding one column per row
+    (e.g. the seam found in the previous frame of a video).
+
+    Returns a list of indices into the 'pixels' list, like
+    minimum_energy_seam.
+    """
+    height, width = energy["height"], energy["width"]
+    pixels = energy["pixels"]
+    inf = float("inf")
+
+    windows = [(max(g - band, 0), min(g + band, width - 1)) for g in guide]
+    backpointers = []
+
+    lo, hi = windows[0]
+    prev = pixels[lo:hi + 1]
+    prev_lo = lo
+
+    for x in range(1, height):
+        lo, hi = windows[x]
+        row = []
+        parents = []
+
+        for w in range(lo, hi + 1):
+            best, parent = inf, None
+            for c in (w - 1, w, w + 1):
+                if prev_lo <= c < prev_lo + len(prev) and prev[c - prev_lo] < best:
+                    best, parent = prev[c - prev_lo], c
+            row.append(pixels[x * width + w] + best)
+            parents.append(parent)
+
+        backpointers.append((lo, parents))
+        prev, prev_lo = row, lo
+
+    col = prev_lo + leftmost_min_col(prev, 0, len(prev))
+    seam = [(height - 1) * width + col]
+
+    for x in range(height - 1, 0, -1):
+        lo, parents = backpointers[x - 1]
+        col = parents[col - lo]
+        seam.append((x - 1) * width + col)
+
+    seam.reverse()
+
+    return seam
+
+
 # HELPER FUNCTIONS FOR LOADING AND SAVING COLOR IMAGES
 
 #  Copied from lab1 >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>
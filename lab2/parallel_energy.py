@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Multi-process energy computation for seam carving.
+
+The Sobel energy of each row only depends on that row and its two
+neighbors, so rows can be computed independently.  ParallelEnergy keeps a
+pool of worker processes alive for a whole carve.  The greyscale image is
+written once per seam into a shared memory block that every worker maps, and
+each worker writes its band of rows into a second shared block, so no pixel
+data is pickled between processes.
+
+Example usage:
+    with ParallelEnergy(im['height'] * im['width'], workers=4) as energy:
+        carved = lab.seam_carving(im, 100, energy_function=energy)
+
+Running this file directly benchmarks seams per second against the number
+of workers:
+    python3 parallel_energy.py test_images/twocats.png 20 1 2 4
+"""
+import sys
+import time
+import multiprocessing
+from array import array
+from multiprocessing import shared_memory
+
+import lab
+
+
+# state of each worker process, set up once by _attach
+_grey = None
+_energy = None
+_blocks = None
+
+
+def _attach(grey_name, energy_name):
+    """
+    Pool initializer: map the shared input and output blocks into this worker.
+    """
+    global _grey, _energy, _blocks
+    _blocks = (shared_memory.SharedMemory(name=grey_name),
+               shared_memory.SharedMemory(name=energy_name))
+    _grey = _blocks[0].buf.cast('d')
+    _energy = _blocks[1].buf
+
+
+def sobel_rows(grey, energy, height, width, first, last):
+    """
+    Compute the energy (see lab.sobel_row) of rows first..last-1 of the
+    height x width image stored row-major in grey, writing the results into
+    the same positions of energy.
+    """
+    def row(x):
+        x = max(min(x, height - 1), 0)
+        return grey[x * width:(x + 1) * width].tolist()
+
+    above, middle = row(first - 1), row(first)
+
+    for x in range(first, last):
+        below = row(x + 1)
+        energy[x * width:(x + 1) * width] = bytes(lab.sobel_row(above, middle, below))
+        above, middle = middle, below
+
+
+def _energy_band(args):
+    """
+    Worker task: compute one band of rows of the shared image.
+    """
+    height, width, first, last = args
+    sobel_rows(_grey, _energy, height, width, first, last)
+
+
+class ParallelEnergy:
+    """
+    Energy function backed by a persistent pool of worker processes.
+
+    Instances are callable with a greyscale image and return the same result
+    as lab.compute_energy.  max_pixels bounds the size of the images that can
+    be passed in; since seam carving only ever shrinks an image, the pixel
+    count of the original image is enough for a whole carve.
+    """
+
+    def __init__(self, max_pixels, workers=None):
+        self.workers = workers or multiprocessing.cpu_count()
+        self.max_pixels = max_pixels
+        self._grey_block = shared_memory.SharedMemory(
+            create=True, size=max(max_pixels, 1) * 8)
+        self._energy_block = shared_memory.SharedMemory(
+            create=True, size=max(max_pixels, 1))
+        self._grey = self._grey_block.buf.cast('d')
+        self._pool = multiprocessing.Pool(
+            self.workers, initializer=_attach,
+            initargs=(self._grey_block.name, self._energy_block.name))
+
+    def __call__(self, grey):
+        height, width = grey["height"], grey["width"]
+        size = height * width
+        assert size <= self.max_pixels, "image is larger than the shared buffer"
+
+        self._grey[:size] = array('d', grey["pixels"])
+
+        bands = min(self.workers, height)
+        edges = [height * i // bands for i in range(bands + 1)]
+        self._pool.map(_energy_band, [(height, width, first, last)
+                                      for first, last in zip(edges, edges[1:])])
+
+        return {"height": height,
+                "width": width,
+                "pixels": list(self._energy_block.buf[:size])}
+
+    def close(self):
+        """
+        Shut down the worker pool and release the shared memory.
+        """
+        self._pool.close()
+        self._pool.join()
+        self._grey.release()
+
+        for block in (self._grey_block, self._energy_block):
+            block.close()
+            block.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def parallel_seam_carving(image, ncols, workers=None, mask=None):
+    """
+    Same as lab.seam_carving, but computes the energy of every pass with a
+    pool of worker processes that stays alive for the whole carve.
+    """
+    with ParallelEnergy(image["height"] * image["width"], workers) as energy:
+        return lab.seam_carving(image, ncols, mask, energy_function=energy)
+
+
+def benchmark(image, ncols, worker_counts):
+    """
+    Carve ncols seams from image once per entry of worker_counts and return a
+    list of (workers, seams per second) tuples.  The serial implementation is
+    reported as 0 workers.
+    """
+    results = []
+
+    for workers in worker_counts:
+        start = time.time()
+        if workers == 0:
+            lab.seam_carving(image, ncols)
+        else:
+            parallel_seam_carving(image, ncols, workers)
+        results.append((workers, ncols / (time.time() - start)))
+
+    return results
+
+
+if __name__ == '__main__':
+    filename = sys.argv[1] if len(sys.argv) > 1 else 'test_images/twocats.png'
+    ncols = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    counts = [int(i) for i in sys.argv[3:]] or [0, 1, 2, 4, 8]
+
+    im = lab.load_color_image(filename)
+    print('%s: %dx%d, carving %d seams' % (filename, im['width'], im['height'], ncols))
+    for workers, rate in benchmark(im, ncols, counts):
+        print('%2d workers: %6.2f seams/second' % (workers, rate))
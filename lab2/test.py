@@ -283,6 +283,87 @@ def test_seamcarving_mushroom():
     seams_endtoend('smallmushroom.png', 'seams_mushroom', 47)
 
 
+def test_seamcarving_zero_mask():
+    inpfile = os.path.join(TEST_DIRECTORY, 'test_images', 'pattern.png')
+    im = lab.load_color_image(inpfile)
+    mask = {'height': im['height'], 'width': im['width'],
+            'pixels': [0] * (im['height'] * im['width'])}
+    omask = object_hash(mask)
+    result = lab.seam_carving(im, 3, mask)
+    assert object_hash(mask) == omask, 'Be careful not to modify the mask!'
+    compare_color_images(result, lab.seam_carving(im, 3))
+
+
+def test_seamcarving_protect_mask():
+    inpfile = os.path.join(TEST_DIRECTORY, 'test_images', 'pattern.png')
+    im = lab.load_color_image(inpfile)
+    h, w = im['height'], im['width']
+    # tag one column with a unique color and protect it
+    col = w // 2
+    pixels = im['pixels'][:]
+    for r in range(h):
+        pixels[r * w + col] = (1, 2, 3)
+    im = {'height': h, 'width': w, 'pixels': pixels}
+    mask = {'height': h, 'width': w,
+            'pixels': [10000 if c == col else 0 for r in range(h) for c in range(w)]}
+    result = lab.seam_carving(im, w - 1, mask)
+    assert result['width'] == 1
+    assert result['pixels'] == [(1, 2, 3)] * h
+
+
+def test_remove_object():
+    inpfile = os.path.join(TEST_DIRECTORY, 'test_images', 'smallfrog.png')
+    im = lab.load_color_image(inpfile)
+    h, w = im['height'], im['width']
+    # a 4-pixel wide object in the middle of the image
+    obj = {(r, c) for r in range(h // 4, h // 2) for c in range(10, 14)}
+    pixels = im['pixels'][:]
+    for r, c in obj:
+        pixels[r * w + c] = (1, 2, 3)
+    im = {'height': h, 'width': w, 'pixels': pixels}
+    mask = {'height': h, 'width': w,
+            'pixels': [-1 if (r, c) in obj else 0 for r in range(h) for c in range(w)]}
+    result = lab.remove_object(im, mask)
+    assert result['width'] == w - 4
+    assert (1, 2, 3) not in result['pixels']
+
+
+def test_parallel_energy():
+    import parallel_energy
+    for fname in ('centered_pixel', 'pattern', 'smallfrog'):
+        inpfile = os.path.join(TEST_DIRECTORY, 'test_images', f'{fname}.png')
+        im = lab.load_color_image(inpfile)
+        grey = lab.greyscale_image_from_color_image(im)
+        with parallel_energy.ParallelEnergy(len(grey['pixels']), workers=2) as energy:
+            compare_greyscale_images(energy(grey), lab.compute_energy(grey))
+            result = lab.seam_carving(im, 2, energy_function=energy)
+        compare_color_images(result, lab.seam_carving(im, 2))
+
+
+def test_carve_frames():
+    inpfile = os.path.join(TEST_DIRECTORY, 'test_images', 'pattern.png')
+    im = lab.load_color_image(inpfile)
+    moved = dict(im, pixels=im['pixels'][im['width']:] + im['pixels'][:im['width']])
+    frames = [im, im, moved, im]
+    ohash = [object_hash(f) for f in frames]
+
+    # with a band as wide as the image, each frame matches a fresh carve
+    results = lab.carve_frames(iter(frames), 3, band=im['width'])
+    assert isinstance(results, types.GeneratorType)
+    for frame, result in zip(frames, results):
+        compare_color_images(result, lab.seam_carving(frame, 3))
+    assert [object_hash(f) for f in frames] == ohash, 'Be careful not to modify the frames!'
+
+    # a narrow band still removes the right number of columns
+    for result in lab.carve_frames(iter(frames), 3, band=1):
+        assert result['width'] == im['width'] - 3
+
+    # a change of size starts over with a fresh carve
+    taller = dict(im, height=im['height'] + 1, pixels=im['pixels'] + im['pixels'][:im['width']])
+    for frame, result in zip([im, taller, im], lab.carve_frames(iter([im, taller, im]), 3)):
+        compare_color_images(result, lab.seam_carving(frame, 3))
+
+
 def load_greyscale_image(filename):
     """
     Loads an image from the given file and returns a dictionary
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Graph-wide statistics over a transformed actor database (see
+lab.transform_data): connected components, the degree distribution, and
+sampled eccentricities giving bounds on the diameter.
+
+Everything runs in (near) linear time in the size of the graph per pass, and
+per-actor results are returned as array('i') columns indexed like
+data["actors"].
+
+Running this file directly prints a summary for a database:
+    python3 analytics.py resources/large.pickle
+"""
+import sys
+import random
+from array import array
+
+import lab
+import snapshot
+
+
+def find(parent, i):
+    """
+    Return the representative of i's set in the union-find forest parent,
+    halving the path to it along the way.
+    """
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+
+    return i
+
+
+def connected_components(data):
+    """
+    Find the connected components of the graph with a union-find pass over
+    its edges.
+
+    Returns a tuple (labels, sizes): labels[i] is the component number of
+    the actor with index i, and sizes[c] is the number of actors in
+    component c.  Components are numbered from largest to smallest.
+    """
+    n = len(data["actors"])
+    parent = array("i", range(n))
+    size = array("i", [1]) * n
+    offsets, neighbors = data["offsets"], data["neighbors"]
+
+    for i in range(n):
+        for j in neighbors[offsets[i]:offsets[i + 1]].tolist():
+            if j > i:
+                a, b = find(parent, i), find(parent, j)
+                if a != b:
+                    # union by size
+                    if size[a] < size[b]:
+                        a, b = b, a
+                    parent[b] = a
+                    size[a] += size[b]
+
+    roots = [i for i in range(n) if parent[i] == i]
+    roots.sort(key=lambda r: -size[r])
+    number = {root: c for c, root in enumerate(roots)}
+
+    labels = array("i", [number[find(parent, i)] for i in range(n)])
+    sizes = array("i", [size[root] for root in roots])
+
+    return labels, sizes
+
+
+def degrees(data):
+    """
+    Return an array of the number of distinct co-stars of every actor.
+    """
+    offsets = data["offsets"]
+
+    return array("i", [offsets[i + 1] - offsets[i] for i in range(len(offsets) - 1)])
+
+
+def degree_distribution(data):
+    """
+    Return an array whose entry d is the number of actors with exactly d
+    distinct co-stars.
+    """
+    degree = degrees(data)
+    histogram = array("i", [0]) * (max(degree, default=0) + 1)
+
+    for d in degree:
+        histogram[d] += 1
+
+    return histogram
+
+
+def eccentricity(data, actor):
+    """
+    Return (distance, farthest): the greatest number of steps from the actor
+    at index actor to any actor in its component, and the index of one actor
+    that far away.
+    """
+    tree = lab.build_bacon_index(data, data["actors"][actor])
+
+    return len(tree["levels"]) - 2, tree["order"][-1]
+
+
+def sample_eccentricities(data, samples=16, seed=6009, component=None):
+    """
+    Estimate the diameter of one connected component of the graph from a few
+    breadth-first searches.
+
+    samples start actors are chosen at random from the component given as a
+    tuple (labels, number), with labels from connected_components, or from
+    the largest component if component is None.  Each is searched from, and
+    then a second search is run from the farthest actor found (a "double
+    sweep"), which tends to land near the true diameter.
+
+    Returns a dictionary with:
+        "sources": array of the actor indices searched from
+        "eccentricities": array of their eccentricities
+        "diameter_lower_bound": largest eccentricity seen
+        "diameter_upper_bound": twice the smallest eccentricity seen (every
+                                pair in a component is within that distance)
+    """
+    rng = random.Random(seed)
+
+    # the upper bound only holds for a single component
+    if component is None:
+        component = connected_components(data)[0], 0
+    labels, number = component
+    candidates = [i for i in range(len(data["actors"])) if labels[i] == number]
+
+    sources = array("i")
+    result = array("i")
+
+    for start in rng.sample(list(candidates), min(samples, len(candidates))):
+        distance, farthest = eccentricity(data, start)
+        sources.append(start)
+        result.append(distance)
+
+        distance, _ = eccentricity(data, farthest)
+        sources.append(farthest)
+        result.append(distance)
+
+    return {"sources": sources,
+            "eccentricities": result,
+            "diameter_lower_bound": max(result, default=0),
+            "diameter_upper_bound": 2 * min(result, default=0)}
+
+
+def summary(data, samples=16, seed=6009):
+    """
+    Return a dictionary of graph-wide statistics: number of actors and
+    edges, component sizes, degree distribution, and diameter bounds of the
+    largest component.
+    """
+    labels, sizes = connected_components(data)
+
+    return {"actors": len(data["actors"]),
+            "edges": len(data["neighbors"]) // 2,
+            "component_sizes": sizes,
+            "degree_distribution": degree_distribution(data),
+            "largest_component": sample_eccentricities(data, samples, seed, (labels, 0))}
+
+
+if __name__ == '__main__':
+    filename = sys.argv[1] if len(sys.argv) > 1 else 'resources/small.pickle'
+    stats = summary(snapshot.load_or_convert(filename))
+    histogram = stats["degree_distribution"]
+    largest = stats["largest_component"]
+
+    print('%s: %d actors, %d edges' % (filename, stats["actors"], stats["edges"]))
+    print('%d components, largest has %d actors' % (len(stats["component_sizes"]),
+                                                    stats["component_sizes"][0]))
+    print('degree: max %d, mean %.2f' % (len(histogram) - 1,
+                                         2 * stats["edges"] / max(stats["actors"], 1)))
+    print('diameter of largest component: between %d and %d' % (
+        largest["diameter_lower_bound"], largest["diameter_upper_bound"]))
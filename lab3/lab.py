@@ -1,8 +1,11 @@
 #!/usr/bin/env python3
 
 import pickle
+import hashlib
+from array import array
+from bisect import bisect_left
 
-# NO ADDITIONAL IMPORTS ALLOWED!
+# Standard library imports only.
 
 # Note that part of your checkoff grade for this lab will be based on the
 # style/clarity of your code.  As you are working through the lab, be on the
@@ -15,130 +18,1100 @@ KEVIN_BACON = 4724
 
 
 def transform_data(raw_data):
+    """
+    Given a list of (actor_id_1, actor_id_2, movie_id) tuples, build a compact
+    graph of who acted with whom.
+
+    Actor IDs are remapped to dense indices (their position in the sorted
+    "actors" array) and adjacency is stored in compressed sparse row form:
+    the neighbors of the actor with index i are
+    neighbors[offsets[i]:offsets[i + 1]], sorted.  Casts of movies are stored
+    the same way, indexed by position in the sorted "movies" array.
+
+    Every adjacency is also labelled with the ID of a movie the two actors
+    were in together: edge_movies[k] goes with neighbors[k].
+
+    Everything is kept in flat array('i') columns rather than dicts of sets,
+    which is an order of magnitude smaller on the large database.
+    """
+    actor_ids = set()
+    movie_ids = set()
+
+    for actor1, actor2, movie_id in raw_data:
+        actor_ids.update((actor1, actor2))
+        movie_ids.add(movie_id)
+
+    actors = array("i", sorted(actor_ids))
+    movies = array("i", sorted(movie_ids))
+    actor_idx = {actor: i for i, actor in enumerate(actors)}
+    movie_idx = {movie: i for i, movie in enumerate(movies)}
 
-    new_data = {"a2a": {}, "m2a": {}}
+    # each edge or cast membership is encoded as a single integer so that
+    # duplicates can be removed and the result sorted in one go
+    n = len(actors)
+    edges = {}
+    casts = set()
 
     for actor1, actor2, movie_id in raw_data:
-        new_data["a2a"].setdefault(actor1, set()).add(actor2)
-        new_data["a2a"].setdefault(actor2, set()).add(actor1)
+        i, j = actor_idx[actor1], actor_idx[actor2]
+        m = movie_idx[movie_id]
+
+        if i != j:
+            edges.setdefault(i * n + j, movie_id)
+            edges.setdefault(j * n + i, movie_id)
+        casts.update((m * n + i, m * n + j))
+
+    edge_keys = sorted(edges)
+    offsets, neighbors = compress_rows(edge_keys, n, n)
+    edge_movies = array("i", [edges[key] for key in edge_keys])
+    movie_offsets, movie_actors = compress_rows(sorted(casts), len(movies), n)
+
+    return {"actors": actors,
+            "offsets": offsets,
+            "neighbors": neighbors,
+            "edge_movies": edge_movies,
+            "movies": movies,
+            "movie_offsets": movie_offsets,
+            "movie_actors": movie_actors}
+
+
+def compress_rows(keys, rows, n):
+    """
+    Given a sorted list of integers row * n + column, return (offsets,
+    columns) arrays in compressed sparse row form for the given number of
+    rows.
+    """
+    offsets = array("i", [0]) * (rows + 1)
+    columns = array("i", [0]) * len(keys)
+
+    for k, key in enumerate(keys):
+        row, columns[k] = divmod(key, n)
+        offsets[row + 1] = k + 1
 
-        new_data["m2a"].setdefault(movie_id, set()).update({actor1, actor2})
+    # rows with no entries inherit the offset of the row before them
+    for row in range(rows):
+        if offsets[row + 1] < offsets[row]:
+            offsets[row + 1] = offsets[row]
 
-    return new_data
+    return offsets, columns
+
+
+def find_index(ids, item):
+    """
+    Return the position of item in the sorted array ids, or None if it is not
+    there.
+    """
+    i = bisect_left(ids, item)
+
+    if i < len(ids) and ids[i] == item:
+        return i
+
+    return None
+
+
+def actor_index(data, actor_id):
+    """
+    Return the dense index of the given actor ID, or None if the actor is not
+    in the database.
+    """
+    return find_index(data["actors"], actor_id)
+
+
+def neighbors(data, i):
+    """
+    Return the indices of the actors who acted with the actor at index i.
+    """
+    return data["neighbors"][data["offsets"][i]:data["offsets"][i + 1]].tolist()
+
+
+def movie_cast(data, movie_id):
+    """
+    Return the indices of the actors in the given movie.
+    """
+    m = find_index(data["movies"], movie_id)
+
+    if m is None:
+        raise KeyError(movie_id)
+
+    return data["movie_actors"][data["movie_offsets"][m]:data["movie_offsets"][m + 1]].tolist()
 
 
 def acted_together(data, actor_id_1, actor_id_2):
     if actor_id_1 == actor_id_2:
         return True
 
-    return actor_id_1 in data["a2a"][actor_id_2]
+    i = actor_index(data, actor_id_1)
+    j = actor_index(data, actor_id_2)
 
+    if i is None or j is None:
+        return False
 
-def actors_with_bacon_number(data, n):
+    return edge_position(data, i, j) is not None
 
-    visited = set()
-    actors = {KEVIN_BACON}
 
-    if n == 0:
-        return actors
+def edge_position(data, i, j):
+    """
+    Return the position in data["neighbors"] of the edge from the actor at
+    index i to the actor at index j, or None if they never acted together.
+    """
+    lo, hi = data["offsets"][i], data["offsets"][i + 1]
+    k = bisect_left(data["neighbors"], j, lo, hi)
 
-    for _ in range(n):
+    if k < hi and data["neighbors"][k] == j:
+        return k
 
-        if len(actors) == 0:
-            break
+    return None
 
-        visited |= actors
 
-        next_actors = set()
+def actors_with_bacon_number(data, n, backend=None):
+    """
+    Return the set of IDs of the actors with Bacon number n.  If backend
+    (e.g. a parallel_bfs.ParallelBFS over data) is given, it answers the
+    query with a fresh search instead of the precomputed index.
+    """
+    if backend is not None:
+        return backend.actors_with_bacon_number(n)
 
-        for a in actors:
-            next_actors |= data["a2a"][a]
+    if n == 0:
+        return {KEVIN_BACON}
 
-        actors = next_actors - visited
+    index = bacon_index(data)
 
-    return actors
+    return {data["actors"][i] for i in level_actors(index, n)}
 
 
 def bacon_path(data, actor_id):
+    return tree_path(data, bacon_index(data), actor_id)
+
+
+def bacon_index(data):
+    """
+    Return the Bacon-number index of the given database (see
+    build_bacon_index), building it on first use and keeping it in data so
+    that later queries are answered without searching.
+    """
+    if "bacon_index" not in data:
+        data["bacon_index"] = build_bacon_index(data)
+
+    return data["bacon_index"]
+
+
+def build_bacon_index(data, root=KEVIN_BACON):
+    """
+    Run one breadth-first search from root over the whole database.
+
+    Returns a dictionary with:
+        "root": the root actor ID
+        "distance": array of the Bacon number of every actor index (-1 if
+                    the actor is not connected to root)
+        "parent": array of the next actor index on a shortest path back to
+                  root (the root is its own parent, unreached actors -1)
+        "order": array of reached actor indices, sorted by Bacon number
+        "levels": array such that the actors with Bacon number n are
+                  order[levels[n]:levels[n + 1]]
+    """
+    size = len(data["actors"])
+    index = {"root": root,
+             "distance": array("i", [-1]) * size,
+             "parent": array("i", [-1]) * size,
+             "order": array("i"),
+             "levels": array("i", [0])}
+
+    start = actor_index(data, root)
+
+    if start is None:
+        return index
+
+    distance, parent = index["distance"], index["parent"]
+    distance[start] = 0
+    parent[start] = start
+    frontier = [start]
+
+    while frontier:
+        index["order"].extend(frontier)
+        index["levels"].append(len(index["order"]))
+        next_frontier = []
+
+        for curr in frontier:
+            for n in neighbors(data, curr):
+                if parent[n] == -1:
+                    parent[n] = curr
+                    distance[n] = distance[curr] + 1
+                    next_frontier.append(n)
+
+        frontier = next_frontier
+
+    return index
+
+
+def level_actors(index, n):
+    """
+    Return the indices of the actors at distance n from the root of the
+    given Bacon-number index.
+    """
+    levels = index["levels"]
+
+    if n < 0 or n >= len(levels) - 1:
+        return []
+
+    return index["order"][levels[n]:levels[n + 1]].tolist()
+
+
+def file_checksum(filename):
+    """
+    Return the SHA-256 hex digest of the contents of the given file.
+    """
+    digest = hashlib.sha256()
+
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def save_bacon_index(index, filename, source_filename):
+    """
+    Save a Bacon-number index to filename, tagged with the checksum of the
+    raw database (source_filename) it was built from.
+    """
+    with open(filename, "wb") as f:
+        pickle.dump({"checksum": file_checksum(source_filename),
+                     "index": index}, f)
+
+
+def load_bacon_index(filename, source_filename):
+    """
+    Load a Bacon-number index saved by save_bacon_index.  Returns None if
+    there is no such file, or if it was built from a different version of
+    source_filename.
+    """
+    try:
+        with open(filename, "rb") as f:
+            saved = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+    if saved.get("checksum") != file_checksum(source_filename):
+        return None
+
+    return saved["index"]
+
+
+def cached_bacon_index(data, source_filename, filename):
+    """
+    Attach a Bacon-number index to data, loading it from filename if it is
+    up to date with source_filename, and otherwise building it and saving it
+    there for next time.  Returns the index.
+    """
+    index = load_bacon_index(filename, source_filename)
+
+    if index is None or len(index["distance"]) != len(data["actors"]):
+        index = build_bacon_index(data)
+        save_bacon_index(index, filename, source_filename)
 
-    return actor_to_actor_path(data, KEVIN_BACON, actor_id)
+    data["bacon_index"] = index
 
+    return index
 
-def helper_actor_path(data, actor_id_1, goal_function, preds, actor_id_2=None):
 
-    visited = {actor_id_1}
-    path = []
+def add_credits(data, raw_data):
+    """
+    Add a list of (actor_id_1, actor_id_2, movie_id) tuples to a transformed
+    database in place.  The result is the same as transforming the old and
+    new raw data together, but only the rows of the actors and movies
+    involved are rebuilt, and the Bacon-number index (if data has one) is
+    repaired by searching outward from the new edges.
+
+    Search trees cached elsewhere, such as in a PathCache, are not updated;
+    clear them afterwards.
+    """
+    make_writable(data)
+    insert_ids(data, {actor for triple in raw_data for actor in triple[:2]},
+               {movie_id for _, _, movie_id in raw_data})
+
+    edges = {}
+    casts = {}
+
+    for actor1, actor2, movie_id in raw_data:
+        i, j = actor_index(data, actor1), actor_index(data, actor2)
+
+        if i != j and edge_position(data, i, j) is None:
+            edges.setdefault(i, {}).setdefault(j, movie_id)
+            edges.setdefault(j, {}).setdefault(i, movie_id)
+        casts.setdefault(find_index(data["movies"], movie_id), set()).update((i, j))
 
-    queue = [actor_id_1]
+    offsets, neighbors_, edge_movies = data["offsets"], data["neighbors"], data["edge_movies"]
+    rows = {}
 
-    index = 0
+    for i, new in edges.items():
+        lo, hi = offsets[i], offsets[i + 1]
+        row = sorted(zip(neighbors_[lo:hi].tolist() + list(new),
+                         edge_movies[lo:hi].tolist() + list(new.values())))
+        rows[i] = ([j for j, _ in row], [movie_id for _, movie_id in row])
 
-    while index < len(queue):
-        curr = queue[index]
+    data["offsets"], (data["neighbors"], data["edge_movies"]) = replace_rows(
+        offsets, (neighbors_, edge_movies), rows)
 
-        if goal_function(curr):
-            if actor_id_2 is None:
-                actor_id_2 = curr
-            break
+    offsets, movie_actors = data["movie_offsets"], data["movie_actors"]
+    rows = {m: (sorted(cast.union(movie_actors[offsets[m]:offsets[m + 1]].tolist())),)
+            for m, cast in casts.items()}
 
-        for n in data["a2a"][curr] - visited:
-            preds[n] = curr
-            queue.append(n)
-            visited.add(n)
-        index += 1
+    data["movie_offsets"], (data["movie_actors"],) = replace_rows(
+        offsets, (movie_actors,), rows)
 
-    if preds.setdefault(actor_id_2, None) is not None:
-        path = [actor_id_2]
-        pred = preds[actor_id_2]
+    if "bacon_index" in data:
+        repair_after_insert(data, data["bacon_index"],
+                            [(i, j) for i, new in edges.items() for j in new])
 
-        while pred is not actor_id_1:
-            path.append(pred)
-            pred = preds[pred]
-        path.append(actor_id_1)
-        path.reverse()
 
-        return path
+def remove_movies(data, movie_ids):
+    """
+    Remove every credit of the given movies from a transformed database in
+    place.  Their casts are emptied, and each edge that was labelled with
+    one of them is relabelled with another movie both actors were in, or
+    removed if there is none (like the raw databases, this assumes every
+    pair of actors in a movie acted together).  Actors and movies stay in
+    the database, possibly with no credits, so that indices do not change.
+    The Bacon-number index (if data has one) is repaired.
+
+    Search trees cached elsewhere, such as in a PathCache, are not updated;
+    clear them afterwards.
+    """
+    make_writable(data)
+    removed = set(movie_ids)
+    actors = set()
+    rows = {}
+
+    for movie_id in removed:
+        actors.update(movie_cast(data, movie_id))
+        rows[find_index(data["movies"], movie_id)] = ([],)
+
+    data["movie_offsets"], (data["movie_actors"],) = replace_rows(
+        data["movie_offsets"], (data["movie_actors"],), rows)
+
+    credits = actor_movies(data, actors)
+    offsets, neighbors_, edge_movies = data["offsets"], data["neighbors"], data["edge_movies"]
+    edges = []
+    rows = {}
+
+    for i in actors:
+        lo, hi = offsets[i], offsets[i + 1]
+        row = list(zip(neighbors_[lo:hi].tolist(), edge_movies[lo:hi].tolist()))
+
+        if not removed.intersection(movie_id for _, movie_id in row):
+            continue
+
+        kept = []
+        for j, movie_id in row:
+            if movie_id in removed:
+                shared = credits[i] & credits[j]
+                if not shared:
+                    if i < j:
+                        edges.append((i, j))
+                    continue
+                movie_id = min(shared)
+            kept.append((j, movie_id))
+        rows[i] = ([j for j, _ in kept], [movie_id for _, movie_id in kept])
+
+    data["offsets"], (data["neighbors"], data["edge_movies"]) = replace_rows(
+        offsets, (neighbors_, edge_movies), rows)
+
+    if "bacon_index" in data:
+        repair_after_delete(data, data["bacon_index"], edges)
+
+
+def make_writable(data):
+    """
+    Replace any read-only columns of data and of its Bacon-number index
+    (such as those of a snapshot loaded with snapshot.load_graph) with arrays
+    that can be updated.
+    """
+    for columns in (data, data.get("bacon_index", {})):
+        for name, column in columns.items():
+            if isinstance(column, memoryview):
+                columns[name] = array("i", column)
+
+
+def merge_ids(ids, new_ids):
+    """
+    Given a sorted array of IDs, return (merged, remap), where merged also
+    contains any of new_ids that were missing and remap[i] is the position
+    of ids[i] in merged.  Returns (ids, None) if nothing was missing.
+    """
+    new_ids = sorted(i for i in set(new_ids) if find_index(ids, i) is None)
+
+    if not new_ids:
+        return ids, None
+
+    remap = array("i", [0]) * len(ids)
+    k = 0
+
+    for i, item in enumerate(ids):
+        while k < len(new_ids) and new_ids[k] < item:
+            k += 1
+        remap[i] = i + k
+
+    return array("i", sorted(ids.tolist() + new_ids)), remap
+
+
+def spread_offsets(offsets, remap, rows):
+    """
+    Return the offsets of a compressed sparse row array after its rows were
+    moved to the positions given by remap, with empty rows in between.
+    """
+    spread = array("i", [0]) * (rows + 1)
+
+    for i, row in enumerate(remap):
+        spread[row + 1] = offsets[i + 1]
+
+    # new rows inherit the offset of the row before them
+    for row in range(rows):
+        if spread[row + 1] < spread[row]:
+            spread[row + 1] = spread[row]
+
+    return spread
+
+
+def insert_ids(data, actor_ids, movie_ids):
+    """
+    Add any of the given actor and movie IDs that a transformed database
+    does not have yet, with no credits.  The indices of the actors after
+    each new one shift up, so every column (and the Bacon-number index, if
+    any) that refers to actor indices is renumbered.
+    """
+    actors, remap = merge_ids(data["actors"], actor_ids)
+
+    if remap is not None:
+        size = len(actors)
+        data["actors"] = actors
+        data["offsets"] = spread_offsets(data["offsets"], remap, size)
+        data["neighbors"] = array("i", [remap[j] for j in data["neighbors"]])
+        data["movie_actors"] = array("i", [remap[j] for j in data["movie_actors"]])
+
+        if "bacon_index" in data:
+            index = data["bacon_index"]
+            distance = array("i", [-1]) * size
+            parent = array("i", [-1]) * size
+
+            for i, new in enumerate(remap):
+                distance[new] = index["distance"][i]
+                if index["parent"][i] != -1:
+                    parent[new] = remap[index["parent"][i]]
+
+            index["distance"], index["parent"] = distance, parent
+            index["order"] = array("i", [remap[i] for i in index["order"]])
+
+    movies, remap = merge_ids(data["movies"], movie_ids)
+
+    if remap is not None:
+        data["movies"] = movies
+        data["movie_offsets"] = spread_offsets(data["movie_offsets"], remap, len(movies))
+
+
+def replace_rows(offsets, columns, rows):
+    """
+    Return new (offsets, columns) in compressed sparse row form with some
+    rows replaced.  columns is a tuple of parallel arrays, and rows maps row
+    numbers to tuples of their new contents, one list per column.  The rows
+    in between are copied over in bulk.
+    """
+    new_offsets = array("i", offsets)
+    new_columns = tuple(array("i") for _ in columns)
+    changed = sorted(rows)
+    copied = 0
+    shift = 0
+
+    for k, row in enumerate(changed):
+        start, end = offsets[row], offsets[row + 1]
+
+        for new, old, values in zip(new_columns, columns, rows[row]):
+            new.extend(old[copied:start])
+            new.extend(values)
+        copied = end
+        shift += len(rows[row][0]) - (end - start)
+
+        # every row up to the next replaced one moves by the same amount
+        stop = changed[k + 1] if k + 1 < len(changed) else len(offsets) - 1
+        if shift:
+            for r in range(row + 1, stop + 1):
+                new_offsets[r] += shift
+
+    for new, old in zip(new_columns, columns):
+        new.extend(old[copied:])
+
+    return new_offsets, new_columns
+
+
+def actor_movies(data, actors):
+    """
+    Return a dictionary mapping each of the given actor indices to the set
+    of IDs of the movies they are in.  This scans every cast once.
+    """
+    credits = {i: set() for i in actors}
+    offsets, cast = data["movie_offsets"], data["movie_actors"]
+
+    for m, movie_id in enumerate(data["movies"]):
+        for i in credits.keys() & set(cast[offsets[m]:offsets[m + 1]].tolist()):
+            credits[i].add(movie_id)
+
+    return credits
+
+
+def repair_after_insert(data, index, edges):
+    """
+    Update a Bacon-number index (see build_bacon_index) after the given
+    (i, j) edges were added to data.  Distances can only go down, so the
+    search starts from the ends of the new edges and only visits the actors
+    that got closer to the root.
+    """
+    distance, parent = index["distance"], index["parent"]
+    changed = {}
+    buckets = {}
+
+    # the root itself may only just have been added
+    start = actor_index(data, index["root"])
+    if start is not None and distance[start] == -1:
+        changed[start] = -1
+        distance[start] = 0
+        parent[start] = start
+        buckets[0] = [start]
+
+    for i, j in edges:
+        relax(index, i, j, buckets, changed)
+        relax(index, j, i, buckets, changed)
+
+    propagate(data, index, buckets, changed)
+    reorder_levels(index, changed)
+
+
+def repair_after_delete(data, index, edges):
+    """
+    Update a Bacon-number index (see build_bacon_index) after the given
+    (i, j) edges were removed from data.
+
+    Only actors whose parent in the tree was cut off are checked, one level
+    at a time: one that still has a neighbor a level closer to the root is
+    reattached to it, and otherwise it has moved further away, so its own
+    children are checked next.  The actors that moved are then searched for
+    again starting from their remaining neighbors.
+    """
+    distance, parent = index["distance"], index["parent"]
+    candidates = {}
+
+    for i, j in edges:
+        for a, b in ((i, j), (j, i)):
+            if parent[b] == a:
+                candidates.setdefault(distance[b], set()).add(b)
+
+    changed = {}
+
+    while candidates:
+        d = min(candidates)
+        for i in candidates.pop(d):
+            for n in neighbors(data, i):
+                if distance[n] == d - 1 and n not in changed:
+                    parent[i] = n
+                    break
+            else:
+                changed[i] = d
+                for n in neighbors(data, i):
+                    if parent[n] == i:
+                        candidates.setdefault(d + 1, set()).add(n)
+
+    for i in changed:
+        distance[i] = parent[i] = -1
+
+    buckets = {}
+    for i in changed:
+        for n in neighbors(data, i):
+            relax(index, n, i, buckets, changed)
+
+    propagate(data, index, buckets, changed)
+    reorder_levels(index, changed)
+
+
+def relax(index, i, j, buckets, changed):
+    """
+    If the actor at index j is closer to the root of the index through its
+    neighbor i than it was, move it there and queue it in buckets by its
+    new distance.  changed keeps the original distance of every actor that
+    moved.
+    """
+    distance = index["distance"]
+
+    if distance[i] != -1 and (distance[j] == -1 or distance[i] + 1 < distance[j]):
+        changed.setdefault(j, distance[j])
+        distance[j] = distance[i] + 1
+        index["parent"][j] = i
+        buckets.setdefault(distance[j], []).append(j)
+
+
+def propagate(data, index, buckets, changed):
+    """
+    Visit the queued actors in order of distance from the root, relaxing
+    the edges to their neighbors, until no more actors move.
+    """
+    while buckets:
+        d = min(buckets)
+        for i in buckets.pop(d):
+            # skip actors that moved again after they were queued
+            if index["distance"][i] == d:
+                for n in neighbors(data, i):
+                    relax(index, i, n, buckets, changed)
+
+
+def reorder_levels(index, changed):
+    """
+    Rebuild the order and levels arrays of an index after the actors in
+    changed (a dictionary of their old distances) moved.  Levels closer to
+    the root than any of the old or new distances are left alone.
+    """
+    if not changed:
+        return
+
+    distance, order, levels = index["distance"], index["order"], index["levels"]
+    first = min(d for i, old in changed.items() for d in (old, distance[i]) if d != -1)
+    start = levels[first]
+
+    by_level = {}
+    for i in set(order[start:].tolist()).union(changed):
+        if distance[i] != -1:
+            by_level.setdefault(distance[i], []).append(i)
+
+    del order[start:]
+    del levels[first + 1:]
+
+    for d in range(first, first + len(by_level)):
+        order.extend(by_level[d])
+        levels.append(len(order))
+
+
+def helper_actor_path(data, starts, goal_function=None, level_goal_function=None,
+                      max_depth=None, node_filter=None, max_expanded=None):
+    """
+    Breadth-first search from the actors at the given indices (all of them
+    at once), one level at a time.
+
+    Goals can be tested one actor at a time or a whole level at a time:
+        goal_function is called with each actor index as it is discovered,
+            and the search stops at the first one it accepts.
+        level_goal_function is called with the list of indices of each
+            complete level (starting with the starts themselves) and returns
+            the ones that are goals; the first of those in the level is used.
+
+    The search can also be bounded:
+        max_depth: actors more than this many steps from the starts are not
+            considered.
+        node_filter: called with each actor index before it is enqueued;
+            actors it rejects are neither goal tested nor expanded.
+        max_expanded: the search gives up after expanding this many actors.
+
+    Returns the path from one of the starts to the goal that was found as a
+    list of actor IDs, or None if no goal was found.
+    """
+    def find_goal(level):
+        if goal_function is not None:
+            for actor in level:
+                if goal_function(actor):
+                    return actor
+
+        if level_goal_function is not None and level:
+            goals = set(level_goal_function(level))
+            for actor in level:
+                if actor in goals:
+                    return actor
+
+        return None
+
+    parents = array("i", [-1]) * len(data["actors"])
+    for start in starts:
+        parents[start] = start
+    frontier = list(starts)
+
+    goal = find_goal(frontier)
+    if goal is not None:
+        return path_from_parents(data, None, goal)
+
+    depth = 0
+    expanded = 0
+
+    while frontier and (max_depth is None or depth < max_depth):
+        next_frontier = []
+
+        for curr in frontier:
+            if max_expanded is not None and expanded >= max_expanded:
+                frontier = []
+                break
+            expanded += 1
+
+            for n in neighbors(data, curr):
+                if parents[n] == -1:
+                    if node_filter is not None and not node_filter(n):
+                        # never look at this actor again
+                        parents[n] = -2
+                        continue
+                    parents[n] = curr
+
+                    if goal_function is not None and goal_function(n):
+                        return path_from_parents(data, parents, n)
+                    next_frontier.append(n)
+
+        if level_goal_function is not None and next_frontier:
+            goal = find_goal(next_frontier)
+            if goal is not None:
+                return path_from_parents(data, parents, goal)
+
+        frontier = next_frontier
+        depth += 1
 
     return None
 
+
+def path_from_parents(data, parents, end):
+    """
+    Follow parent pointers from the actor at index end back to the root of
+    the search (the actor that is its own parent), returning the path from
+    root to end as a list of actor IDs.  If parents is None, end is the root.
+    """
+    path = [end]
+
+    while parents is not None and parents[path[-1]] != path[-1]:
+        path.append(parents[path[-1]])
+    path.reverse()
+
+    return [data["actors"][i] for i in path]
+
+
 def actor_to_actor_path(data, actor_id_1, actor_id_2):
-    preds = {actor_id_2: None}
+    start = actor_index(data, actor_id_1)
+    end = actor_index(data, actor_id_2)
 
-    def goal(actor):
-        return actor == actor_id_2
+    if start is None or end is None:
+        return None
 
-    return helper_actor_path(data, actor_id_1, goal, preds, actor_id_2)
+    return bidirectional_path(data, start, end)
 
-def actor_path(data, actor_id_1, goal_test_function):
-    if goal_test_function(actor_id_1):
-        return [actor_id_1]
 
-    preds = {}
+def bidirectional_path(data, start, end):
+    """
+    Find a shortest path between the actors at indices start and end by
+    searching from both ends at once, always expanding a whole level of
+    whichever frontier is smaller, until the two searches meet.
+
+    Returns the path as a list of actor IDs, or None if there is none.
+    """
+    if start == end:
+        return path_from_parents(data, None, start)
+
+    # for each side: depth of every actor it has seen, parent pointers, and
+    # the current frontier
+    sides = [({start: 0}, {start: start}, [start]),
+             ({end: 0}, {end: end}, [end])]
+
+    while sides[0][2] and sides[1][2]:
+        if len(sides[1][2]) < len(sides[0][2]):
+            sides.reverse()
+
+        (depth, parents, frontier), (other_depth, _, _) = sides
+        next_frontier = []
+        meet = None
+
+        for curr in frontier:
+            for n in neighbors(data, curr):
+                if n not in depth:
+                    depth[n] = depth[curr] + 1
+                    parents[n] = curr
+                    next_frontier.append(n)
+
+                    if n in other_depth and (meet is None or other_depth[n] < other_depth[meet]):
+                        meet = n
 
-    return helper_actor_path(data, actor_id_1, goal_test_function, preds)
+        sides[0] = (depth, parents, next_frontier)
+
+        if meet is not None:
+            if sides[0][1].get(start) != start:
+                sides.reverse()
+            head = path_from_parents(data, sides[0][1], meet)
+            tail = path_from_parents(data, sides[1][1], meet)
+
+            return head + tail[-2::-1]
+
+    return None
+
+
+def movie_path(data, actor_id_1, actor_id_2):
+    """
+    Find a shortest path between the two actors, along with the movies that
+    link them.
+
+    Returns a tuple (actors, movies), where actors is the path as a list of
+    actor IDs and movies[k] is the ID of a movie that actors[k] and
+    actors[k + 1] were both in, or None if there is no path.
+    """
+    actors = actor_to_actor_path(data, actor_id_1, actor_id_2)
+
+    if actors is None:
+        return None
+
+    path = [actor_index(data, actor) for actor in actors]
+    movies = [data["edge_movies"][edge_position(data, i, j)]
+              for i, j in zip(path, path[1:])]
+
+    return actors, movies
+
+
+def actor_path(data, actor_id_1, goal_test_function=None, backend=None,
+               level_goal_function=None, max_depth=None, node_filter=None,
+               max_expanded=None):
+    """
+    Return a shortest path (as a list of actor IDs) from actor_id_1 to any
+    actor satisfying goal_test_function, or None if there is none.  If
+    backend (e.g. a parallel_bfs.ParallelBFS over data) is given, it runs
+    the search; backends need a goal_test_function and do not support any
+    of the other arguments (ValueError).
+
+    The remaining arguments work as in helper_actor_path, but with actor IDs
+    instead of indices: level_goal_function is given the list of IDs of a
+    whole level and returns the ones that are goals, and node_filter is
+    given an actor ID.  For example, the closest actor within 3 steps who
+    was in a film with cast film_cast (a set of IDs):
+        actor_path(data, actor_id, max_depth=3,
+                   level_goal_function=film_cast.intersection)
+    """
+    if backend is not None:
+        if goal_test_function is None or not (
+                level_goal_function is max_depth is node_filter is max_expanded is None):
+            raise ValueError("backends only support searches for goal_test_function, "
+                             "without limits")
+        return backend.actor_path(actor_id_1, goal_test_function)
+
+    start = actor_index(data, actor_id_1)
+
+    if start is None:
+        if goal_test_function is not None and goal_test_function(actor_id_1):
+            return [actor_id_1]
+        return None
+
+    actors = data["actors"]
+
+    def by_id(function):
+        if function is None:
+            return None
+        return lambda actor: function(actors[actor])
+
+    def level_by_id(level):
+        goals = set(level_goal_function([actors[i] for i in level]))
+        return [i for i in level if actors[i] in goals]
+
+    return helper_actor_path(
+        data, [start], by_id(goal_test_function),
+        level_by_id if level_goal_function is not None else None,
+        max_depth, by_id(node_filter), max_expanded)
 
 
 def actors_connecting_films(data, film1, film2):
+    """
+    Return a shortest list of actor IDs connecting an actor in film1 to an
+    actor in film2, or None if the two films are not connected.
+
+    This is a single breadth-first search seeded with the whole cast of
+    film1, which stops at the first member of film2's cast it reaches.
+    """
+    film1_actors = movie_cast(data, film1)
+    film2_actors = set(movie_cast(data, film2))
+
+    return helper_actor_path(data, film1_actors,
+                             lambda actor: actor in film2_actors)
+
+
+def tree_path(data, tree, actor_id):
+    """
+    Return the shortest path from the root of the given breadth-first search
+    tree (see build_bacon_index) to actor_id, or None if there is none.
+    """
+    end = actor_index(data, actor_id)
+
+    if end is None or tree["distance"][end] == -1:
+        return None
+
+    return path_from_parents(data, tree["parent"], end)
+
+
+def tree_size(tree):
+    """
+    Return the number of bytes used by the arrays of a search tree.
+    """
+    return sum(column.itemsize * len(column)
+               for column in tree.values() if isinstance(column, array))
+
+
+class PathCache:
+    """
+    Bounded cache of breadth-first search trees over one database, keyed by
+    source actor ID and evicted in least-recently-used order once the trees
+    take up more than max_bytes.
+
+    hits and misses count how often a tree was reused or had to be built.
+    """
+
+    def __init__(self, data, max_bytes=1 << 26):
+        self.data = data
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        # dicts keep insertion order, so the first key is always the least
+        # recently used one
+        self.trees = {}
+
+    def tree(self, source):
+        """
+        Return the search tree rooted at the given actor ID.
+        """
+        if source in self.trees:
+            self.hits += 1
+            tree = self.trees.pop(source)
+        else:
+            self.misses += 1
+            tree = build_bacon_index(self.data, source)
+            self.size += tree_size(tree)
+
+        self.trees[source] = tree
+
+        while self.size > self.max_bytes and len(self.trees) > 1:
+            self.size -= tree_size(self.trees.pop(next(iter(self.trees))))
+
+        return tree
+
+    def path(self, source, target):
+        """
+        Return a shortest path from source to target, or None if there is
+        none.
+        """
+        return tree_path(self.data, self.tree(source), target)
+
+    def paths(self, pairs):
+        """
+        Answer a batch of (source, target) queries; see actor_paths.
+        """
+        return actor_paths(self.data, pairs, self)
+
+    def hit_rate(self):
+        """
+        Return the fraction of tree lookups that were served from the cache.
+        """
+        total = self.hits + self.misses
+
+        return self.hits / total if total else 0.0
+
+    def clear(self):
+        """
+        Drop every cached tree (e.g. after the database has changed).
+        """
+        self.trees = {}
+        self.size = 0
+
+
+def actor_paths(data, pairs, cache=None):
+    """
+    Given a list of (source, target) actor ID pairs, return the list of
+    shortest paths between them (None where there is no path), in the same
+    order.
+
+    Queries are grouped by source so each group is answered from a single
+    breadth-first search tree, taken from cache (a PathCache) if given.
+    """
+    by_source = {}
+
+    for k, (source, target) in enumerate(pairs):
+        by_source.setdefault(source, []).append((k, target))
 
-    film1_actors = data["m2a"][film1]
-    film2_actors = data["m2a"][film2]
+    results = [None] * len(pairs)
 
-    paths = []
+    for source, queries in by_source.items():
+        tree = cache.tree(source) if cache is not None else build_bacon_index(data, source)
 
-    for actor1 in film1_actors:
-        for actor2 in film2_actors:
-            path = actor_to_actor_path(data, actor1, actor2)
+        for k, target in queries:
+            results[k] = tree_path(data, tree, target)
 
-            if path is not None:
-                paths.append(path)
+    return results
 
-    min_path_idx = 0
 
-    for i in range(len(paths)):
-        if len(paths[i]) < len(paths[min_path_idx]):
-            min_path_idx = i
+def build_name_index(names):
+    """
+    Given a dictionary mapping actor names to IDs (as in names.pickle),
+    return an index for looking names up by exact name, prefix or ignoring
+    case, and IDs up by name, each in O(log n + k) time.
+
+    The index is a dictionary of parallel sorted columns:
+        "names", "ids": names in sorted order and their IDs
+        "folded", "folded_names", "folded_ids": case-folded names in
+                                                sorted order, and the
+                                                original names and IDs
+        "by_id", "id_names": IDs in sorted order and their names
+    """
+    exact = sorted(names.items())
+    folded = sorted((name.casefold(), name) for name in names)
+    by_id = sorted((actor_id, name) for name, actor_id in names.items())
+
+    return {"names": [name for name, _ in exact],
+            "ids": array("i", [actor_id for _, actor_id in exact]),
+            "folded": [key for key, _ in folded],
+            "folded_names": [name for _, name in folded],
+            "folded_ids": array("i", [names[name] for _, name in folded]),
+            "by_id": array("i", [actor_id for actor_id, _ in by_id]),
+            "id_names": [name for _, name in by_id]}
+
+
+def name_columns(index, ignore_case):
+    """
+    Return the (keys, names, ids) columns of a name index to search in, and
+    a function that turns a query into a key.
+    """
+    if ignore_case:
+        return index["folded"], index["folded_names"], index["folded_ids"], str.casefold
+
+    return index["names"], index["names"], index["ids"], str
+
+
+def actor_id_from_name(index, name, ignore_case=False):
+    """
+    Return the ID of the actor with the given name, or None if there is no
+    such actor.  If ignore_case is True and several names only differ by
+    case, the first of them in sorted order is used.
+    """
+    keys, _, ids, key = name_columns(index, ignore_case)
+    i = find_index(keys, key(name))
+
+    return None if i is None else ids[i]
+
+
+def actors_with_name_prefix(index, prefix, ignore_case=False, limit=None):
+    """
+    Return a list of (name, ID) tuples, in sorted order, of the actors whose
+    names start with prefix; at most limit of them if limit is given.
+    """
+    keys, names, ids, key = name_columns(index, ignore_case)
+    prefix = key(prefix)
+    result = []
+    i = bisect_left(keys, prefix)
+
+    while i < len(keys) and keys[i].startswith(prefix) and (limit is None or len(result) < limit):
+        result.append((names[i], ids[i]))
+        i += 1
+
+    return result
+
+
+def actor_name(index, actor_id):
+    """
+    Return the name of the actor with the given ID, or None if the index
+    does not have it.
+    """
+    i = find_index(index["by_id"], actor_id)
 
-    return paths[min_path_idx]
+    return None if i is None else index["id_names"][i]
 
 
 if __name__ == '__main__':
@@ -160,16 +1133,14 @@ if __name__ == '__main__':
     import pdb
     pdb.set_trace()
 
-    with open("resources/large.pickle", "rb") as f:
-        largedb = pickle.load(f)
-    res2 = bacon_path(transform_data(largedb), 1240)
+    import snapshot
+    largedb = snapshot.load_or_convert("resources/large.pickle")
+    res2 = bacon_path(largedb, 1240)
 
     """ 2.2
     with open("resources/names.pickle", "rb") as f:
         namesdb = pickle.load(f)
-    print(type(namesdb))
-    print(namesdb["Julian O'Donnell"])
-    for n in namesdb:
-        if namesdb[n] == 1:
-            print(n)
+    names = build_name_index(namesdb)
+    print(actor_id_from_name(names, "Julian O'Donnell"))
+    print(actor_name(names, 1))
     """
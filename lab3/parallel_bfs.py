@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Level-synchronous breadth-first search across a pool of processes.
+
+ParallelBFS copies the adjacency arrays of a transformed database (see
+lab.transform_data) into shared memory once, along with a visited bitmap,
+and keeps a pool of worker processes attached to them.  Each level of a
+search is split into chunks; workers expand their chunk against the bitmap
+and send back the newly reached actors with their parents.  The parent
+process merges the results, marks the new actors in the bitmap, and runs the
+goal test, so workers only ever read shared state.
+
+It can be passed as the backend of lab.actor_path and
+lab.actors_with_bacon_number:
+    with ParallelBFS(data, workers=4) as backend:
+        lab.actor_path(data, 4724, lambda p: p == 1345462, backend=backend)
+
+Running this file directly benchmarks path queries on a database against the
+number of workers:
+    python3 parallel_bfs.py resources/large.pickle 1 2 4
+"""
+import sys
+import time
+import random
+import multiprocessing
+from array import array
+from multiprocessing import shared_memory
+
+import lab
+import snapshot
+
+
+# state of each worker process, set up once by _attach
+_offsets = None
+_neighbors = None
+_visited = None
+_blocks = None
+
+
+def _attach(offsets_name, neighbors_name, visited_name):
+    """
+    Pool initializer: map the shared adjacency arrays and bitmap into this
+    worker.
+    """
+    global _offsets, _neighbors, _visited, _blocks
+    _blocks = [shared_memory.SharedMemory(name=name)
+               for name in (offsets_name, neighbors_name, visited_name)]
+    _offsets = _blocks[0].buf.cast('i')
+    _neighbors = _blocks[1].buf.cast('i')
+    _visited = _blocks[2].buf
+
+
+def expand(offsets, neighbors, visited, frontier):
+    """
+    Return arrays (children, parents) of the actors adjacent to the given
+    frontier that are not marked in the visited bitmap, each listed once with
+    the frontier actor it was first reached from.
+    """
+    children = array('i')
+    parents = array('i')
+    seen = set()
+
+    for curr in frontier:
+        for n in neighbors[offsets[curr]:offsets[curr + 1]].tolist():
+            if not visited[n >> 3] >> (n & 7) & 1 and n not in seen:
+                seen.add(n)
+                children.append(n)
+                parents.append(curr)
+
+    return children, parents
+
+
+def _expand_chunk(frontier):
+    """
+    Worker task: expand one chunk of a frontier.
+    """
+    return expand(_offsets, _neighbors, _visited, frontier)
+
+
+class ParallelBFS:
+    """
+    Breadth-first search backend for one database, backed by a persistent
+    pool of worker processes.
+
+    Frontiers smaller than serial_threshold are expanded in this process,
+    since sending them to the workers would cost more than it saves.
+    """
+
+    def __init__(self, data, workers=None, serial_threshold=1000):
+        self.data = data
+        self.workers = workers or multiprocessing.cpu_count()
+        self.serial_threshold = serial_threshold
+
+        size = len(data["actors"])
+        self._blocks = []
+        for column, nbytes in ((data["offsets"], 4 * len(data["offsets"])),
+                               (data["neighbors"], 4 * len(data["neighbors"])),
+                               (None, (size + 7) // 8)):
+            block = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+            if column is not None:
+                block.buf[:nbytes] = array('i', column).tobytes()
+            self._blocks.append(block)
+
+        self._offsets = self._blocks[0].buf.cast('i')
+        self._neighbors = self._blocks[1].buf.cast('i')
+        self._visited = self._blocks[2].buf
+        self._pool = multiprocessing.Pool(
+            self.workers, initializer=_attach,
+            initargs=tuple(block.name for block in self._blocks))
+
+    def search(self, starts, goal_function=None, max_depth=None):
+        """
+        Search outward from the given actor indices, one level at a time.
+
+        Returns a tuple (parents, found, frontier): the parent array of the
+        search, the index of the first actor accepted by goal_function (or
+        None), and the last level reached (all of it, if the search stopped
+        at max_depth).
+        """
+        visited = self._visited
+        visited[:] = bytes(len(visited))
+        parents = array('i', [-1]) * len(self.data["actors"])
+
+        for start in starts:
+            parents[start] = start
+            visited[start >> 3] |= 1 << (start & 7)
+            if goal_function is not None and goal_function(start):
+                return parents, start, list(starts)
+
+        frontier = list(starts)
+        depth = 0
+
+        while frontier and (max_depth is None or depth < max_depth):
+            next_frontier = []
+
+            for n, curr in self._expand_level(frontier, parents):
+                if parents[n] != -1:
+                    continue
+                parents[n] = curr
+                visited[n >> 3] |= 1 << (n & 7)
+
+                if goal_function is not None and goal_function(n):
+                    return parents, n, next_frontier
+                next_frontier.append(n)
+
+            frontier = next_frontier
+            depth += 1
+
+        return parents, None, frontier
+
+    def _expand_level(self, frontier, parents):
+        """
+        Yield (child, parent) pairs for the actors adjacent to the given
+        frontier that have not been reached yet.  The same child may appear
+        more than once.
+        """
+        if len(frontier) < self.serial_threshold or self.workers == 1:
+            offsets, neighbors = self._offsets, self._neighbors
+            for curr in frontier:
+                for n in neighbors[offsets[curr]:offsets[curr + 1]].tolist():
+                    if parents[n] == -1:
+                        yield n, curr
+            return
+
+        chunks = self.workers * 4
+        size = -(-len(frontier) // chunks)
+
+        for children, froms in self._pool.map(
+                _expand_chunk, [frontier[i:i + size] for i in range(0, len(frontier), size)]):
+            yield from zip(children, froms)
+
+    def actor_path(self, actor_id, goal_test_function):
+        """
+        Same as lab.actor_path on the database this backend was built for.
+        """
+        if goal_test_function(actor_id):
+            return [actor_id]
+
+        start = lab.actor_index(self.data, actor_id)
+        if start is None:
+            return None
+
+        actors = self.data["actors"]
+        parents, found, _ = self.search(
+            [start], lambda actor: goal_test_function(actors[actor]))
+
+        return None if found is None else lab.path_from_parents(self.data, parents, found)
+
+    def actors_with_bacon_number(self, n):
+        """
+        Same as lab.actors_with_bacon_number on the database this backend was
+        built for.
+        """
+        if n == 0:
+            return {lab.KEVIN_BACON}
+
+        start = lab.actor_index(self.data, lab.KEVIN_BACON)
+        if start is None:
+            return set()
+
+        _, _, frontier = self.search([start], max_depth=n)
+
+        return {self.data["actors"][i] for i in frontier}
+
+    def close(self):
+        """
+        Shut down the worker pool and release the shared memory.
+        """
+        self._pool.close()
+        self._pool.join()
+        for view in (self._offsets, self._neighbors, self._visited):
+            view.release()
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def benchmark(data, targets, worker_counts):
+    """
+    Time a Bacon path query to each of the given actor IDs once per entry of
+    worker_counts, returning a list of (workers, queries per second) tuples.
+    The serial implementation in lab.py is reported as 0 workers.
+    """
+    results = []
+
+    for workers in worker_counts:
+        if workers == 0:
+            start = time.time()
+            for target in targets:
+                lab.actor_path(data, lab.KEVIN_BACON, lambda p: p == target)
+        else:
+            with ParallelBFS(data, workers) as backend:
+                start = time.time()
+                for target in targets:
+                    backend.actor_path(lab.KEVIN_BACON, lambda p: p == target)
+        results.append((workers, len(targets) / (time.time() - start)))
+
+    return results
+
+
+if __name__ == '__main__':
+    filename = sys.argv[1] if len(sys.argv) > 1 else 'resources/large.pickle'
+    counts = [int(i) for i in sys.argv[2:]] or [0, 1, 2, 4, 8]
+
+    data = snapshot.load_or_convert(filename)
+    targets = random.Random(6009).sample(list(data["actors"]), 20)
+    print('%s: %d actors, %d edges' % (filename, len(data["actors"]), len(data["neighbors"])))
+    for workers, rate in benchmark(data, targets, counts):
+        print('%2d workers: %6.2f queries/second' % (workers, rate))
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Binary snapshots of the transformed actor graph (see lab.transform_data).
+
+A snapshot is a small header followed by the flat integer columns of the
+graph, each stored exactly as it is laid out in memory.  Loading one maps the
+file with mmap and hands out memoryviews over it, so startup time does not
+depend on the size of the graph, and several server processes loading the
+same snapshot share the same pages of memory.  If the database has a
+Bacon-number index (see lab.build_bacon_index), its columns are stored in the
+snapshot too, so the server does not have to search or unpickle anything at
+startup.
+
+Layout (all integers little-endian unless noted):
+    magic        8 bytes, b'6009GRPH'
+    version      uint32
+    itemsize     uint32, size of each column item (4)
+    byteorder    8 bytes, b'little' or b'big' (padded), order of the columns
+    count        uint32, number of columns
+    count times: name (16 bytes, padded), offset (uint64), length (uint64)
+    the columns themselves, each starting on an 8-byte boundary
+
+The columns of a Bacon-number index are named after its keys with a
+"bacon_" prefix, and its root is stored as the one-item column bacon_root.
+
+Example usage:
+    python3 snapshot.py resources/small.pickle resources/large.pickle
+
+creates resources/small.graph and resources/large.graph, which can then be
+loaded with:
+    data = snapshot.load_graph('resources/large.graph')
+"""
+import os
+import sys
+import mmap
+import glob
+import pickle
+import struct
+from array import array
+
+import lab
+
+
+MAGIC = b'6009GRPH'
+VERSION = 2
+HEADER = struct.Struct('<8sII8sI')
+ENTRY = struct.Struct('<16sQQ')
+
+
+# columns of a Bacon-number index, stored as bacon_<name>
+BACON_COLUMNS = ('distance', 'parent', 'order', 'levels')
+
+
+def save_graph(data, filename):
+    """
+    Write the array columns of the given transformed database to filename as
+    a snapshot, along with its Bacon-number index if it has one.  Other
+    entries of data that are not arrays are not saved.
+    """
+    columns = [(name, array('i', column)) for name, column in sorted(data.items())
+               if isinstance(column, (array, memoryview))]
+
+    if "bacon_index" in data:
+        index = data["bacon_index"]
+        columns.append(('bacon_root', array('i', [index["root"]])))
+        columns.extend(('bacon_' + name, array('i', index[name])) for name in BACON_COLUMNS)
+
+    offset = HEADER.size + ENTRY.size * len(columns)
+    entries = []
+
+    for name, column in columns:
+        offset += -offset % 8
+        entries.append((name.encode('ascii'), offset, len(column)))
+        offset += len(column) * column.itemsize
+
+    with open(filename, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, array('i').itemsize,
+                            sys.byteorder.encode('ascii'), len(columns)))
+        for entry in entries:
+            f.write(ENTRY.pack(*entry))
+
+        for (_, start, _), (_, column) in zip(entries, columns):
+            f.write(bytes(start - f.tell()))
+            column.tofile(f)
+
+
+def load_graph(filename):
+    """
+    Map the snapshot in filename into memory and return a database usable by
+    the functions in lab.py, whose columns (and those of its Bacon-number
+    index, if one was saved) are read-only memoryviews over the file.
+    """
+    with open(filename, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, version, itemsize, byteorder, count = HEADER.unpack_from(mapped, 0)
+
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('%r is not a graph snapshot' % filename)
+    if itemsize != array('i').itemsize or byteorder.rstrip(b'\0').decode() != sys.byteorder:
+        raise ValueError('%r was written on an incompatible platform' % filename)
+
+    view = memoryview(mapped)
+    data = {}
+
+    for i in range(count):
+        name, offset, length = ENTRY.unpack_from(mapped, HEADER.size + i * ENTRY.size)
+        name = name.rstrip(b'\0').decode('ascii')
+        data[name] = view[offset:offset + length * itemsize].cast('i')
+
+    if 'bacon_root' in data:
+        index = {name: data.pop('bacon_' + name) for name in BACON_COLUMNS}
+        index['root'] = data.pop('bacon_root')[0]
+        data['bacon_index'] = index
+
+    return data
+
+
+def convert(pickle_filename, graph_filename=None, bacon_index=False):
+    """
+    Transform the raw database in pickle_filename (a list of (actor, actor,
+    movie) tuples) and save it as a snapshot, by default next to it with a
+    .graph extension, including its Bacon-number index if bacon_index is
+    true.  Returns the name of the snapshot.
+    """
+    if graph_filename is None:
+        graph_filename = os.path.splitext(pickle_filename)[0] + '.graph'
+
+    with open(pickle_filename, 'rb') as f:
+        raw = pickle.load(f)
+
+    data = lab.transform_data(raw)
+    if bacon_index:
+        lab.bacon_index(data)
+
+    save_graph(data, graph_filename)
+
+    return graph_filename
+
+
+def load_or_convert(pickle_filename, bacon_index=False):
+    """
+    Load the snapshot for the given raw database, (re)creating it first if it
+    is missing, older than the pickle, or written by another version of this
+    module, or if bacon_index is true and it has no Bacon-number index.
+    """
+    graph_filename = os.path.splitext(pickle_filename)[0] + '.graph'
+
+    if (os.path.exists(graph_filename)
+            and os.path.getmtime(graph_filename) >= os.path.getmtime(pickle_filename)):
+        try:
+            data = load_graph(graph_filename)
+        except ValueError:
+            pass
+        else:
+            if not bacon_index or 'bacon_index' in data:
+                return data
+
+    convert(pickle_filename, graph_filename, bacon_index)
+
+    return load_graph(graph_filename)
+
+
+if __name__ == '__main__':
+    filenames = sys.argv[1:] or [
+        i for i in sorted(glob.glob(os.path.join(os.path.dirname(__file__), 'resources', '*.pickle')))
+        if not i.endswith(('names.pickle', 'movies.pickle'))]
+
+    for filename in filenames:
+        print('%s -> %s' % (filename, convert(filename)))
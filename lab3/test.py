@@ -41,6 +41,18 @@ def test_acted_together_03():
     assert lab.acted_together(db_small, actor1, actor2)
 
 
+def test_transform_data_compact():
+    # every edge of the raw data is stored in both directions, once
+    for raw, db in ((raw_db_tiny, db_tiny), (raw_db_small, db_small)):
+        expected = {(a, b) for a, b, _ in raw if a != b}
+        expected |= {(b, a) for a, b in expected}
+        result = {(db['actors'][i], db['actors'][j])
+                  for i in range(len(db['actors']))
+                  for j in lab.neighbors(db, i)}
+        assert result == expected
+        assert len(db['neighbors']) == len(expected)
+
+
 def test_tiny_bacon_number():
     # Actors with bacon number 0
     n0 = 0
@@ -291,6 +303,229 @@ def test_movie_path_01():
 def test_movie_path_02():
     check_connected_movie_path(142416, 44521, 4)
 
+def test_movie_path_not_connected():
+    data = lab.transform_data([(1, 2, 10), (3, 4, 20), (4, 5, 30)])
+    assert lab.actors_connecting_films(data, 10, 20) is None
+    assert lab.actors_connecting_films(data, 20, 30) == [4]
+    assert lab.actors_connecting_films(data, 30, 20) == [4]
+
+
+def test_bacon_index_saved(tmp_path):
+    source = os.path.join(TEST_DIRECTORY, 'resources', 'small.pickle')
+    filename = str(tmp_path / 'small.bacon')
+    data = lab.transform_data(raw_db_small)
+    index = lab.cached_bacon_index(data, source, filename)
+    assert lab.load_bacon_index(filename, source) == index
+
+    # a fresh database picks up the saved index instead of searching again
+    data = lab.transform_data(raw_db_small)
+    lab.cached_bacon_index(data, source, filename)
+    assert data['bacon_index'] == index
+    assert lab.actors_with_bacon_number(data, 2) == lab.actors_with_bacon_number(db_small, 2)
+
+    # an index built from different data is not loaded
+    tiny = os.path.join(TEST_DIRECTORY, 'resources', 'tiny.pickle')
+    assert lab.load_bacon_index(filename, tiny) is None
+
+
+def test_graph_snapshot(tmp_path):
+    import snapshot
+    filename = str(tmp_path / 'small.graph')
+    snapshot.save_graph(db_small, filename)
+    data = snapshot.load_graph(filename)
+    for name in ('actors', 'offsets', 'neighbors', 'edge_movies', 'movies', 'movie_offsets', 'movie_actors'):
+        assert list(data[name]) == list(db_small[name])
+
+    assert lab.acted_together(data, 4724, 9210)
+    assert not lab.acted_together(data, 4724, 16935)
+    assert lab.actors_with_bacon_number(data, 2) == lab.actors_with_bacon_number(db_small, 2)
+    check_valid_path(raw_db_small, lab.bacon_path(data, 46866), 4724, 46866, 3)
+
+
+def test_graph_snapshot_bacon_index(tmp_path):
+    import shutil
+    import snapshot
+    source = str(tmp_path / 'small.pickle')
+    shutil.copy(os.path.join(TEST_DIRECTORY, 'resources', 'small.pickle'), source)
+
+    # the index is built once and then mapped from the snapshot with the graph
+    data = snapshot.load_or_convert(source, bacon_index=True)
+    mtime = os.path.getmtime(str(tmp_path / 'small.graph'))
+    data = snapshot.load_or_convert(source, bacon_index=True)
+    assert os.path.getmtime(str(tmp_path / 'small.graph')) == mtime
+    index, expected = data['bacon_index'], lab.build_bacon_index(db_small)
+    assert isinstance(index['distance'], memoryview)
+    assert index['root'] == expected['root']
+    for name in ('distance', 'parent', 'order', 'levels'):
+        assert list(index[name]) == list(expected[name])
+    assert lab.actors_with_bacon_number(data, 3) == lab.actors_with_bacon_number(db_small, 3)
+
+    # the mapped index can still be repaired in place
+    bacon_movie = next(movie for a1, a2, movie in raw_db_small if lab.KEVIN_BACON in (a1, a2))
+    lab.remove_movies(data, [bacon_movie])
+    expected = lab.transform_data([i for i in raw_db_small if i[2] != bacon_movie])
+    for n in range(5):
+        assert lab.actors_with_bacon_number(data, n) == lab.actors_with_bacon_number(expected, n)
+
+
+def test_movie_path_labels():
+    for actor_id in (46866, 1640, 4724):
+        actors, movies = lab.movie_path(db_small, 4724, actor_id)
+        check_valid_path(raw_db_small, actors, 4724, actor_id, len(actors) - 1)
+        assert len(movies) == len(actors) - 1
+        for a, b, m in zip(actors, actors[1:], movies):
+            assert (a, b, m) in raw_db_small or (b, a, m) in raw_db_small
+    assert lab.movie_path(db_small, 4724, 2876669) is None
+
+
+def test_actor_paths_cached():
+    ids = [4724, 46866, 1640, 2876669, 9210]
+    pairs = [(a, b) for a in ids for b in ids]
+    cache = lab.PathCache(db_small)
+    result = cache.paths(pairs)
+    assert result == lab.actor_paths(db_small, pairs)
+    for (a, b), p in zip(pairs, result):
+        expected = lab.actor_to_actor_path(db_small, a, b)
+        assert (p is None) == (expected is None)
+        if p is not None:
+            check_valid_path(raw_db_small, p, a, b, len(expected) - 1)
+    assert (cache.hits, cache.misses) == (0, len(ids))
+
+    cache.paths(pairs)
+    assert (cache.hits, cache.misses) == (len(ids), len(ids))
+    assert cache.hit_rate() == 0.5
+
+    # a cache with room for a single tree keeps only the most recent one
+    small = lab.PathCache(db_small, max_bytes=1)
+    small.paths(pairs)
+    assert list(small.trees) == [ids[-1]]
+    assert small.size == lab.tree_size(small.trees[ids[-1]])
+
+
+def test_parallel_backend():
+    import parallel_bfs
+    # a threshold of 1 sends every level to the worker processes
+    with parallel_bfs.ParallelBFS(db_small, workers=2, serial_threshold=1) as backend:
+        for n in range(5):
+            assert lab.actors_with_bacon_number(db_small, n, backend=backend) == \
+                lab.actors_with_bacon_number(db_small, n)
+        result = lab.actor_path(db_small, 4724, lambda p: p == 46866, backend=backend)
+        check_valid_path(raw_db_small, result, 4724, 46866, 3)
+        assert lab.actor_path(db_small, 4724, lambda p: False, backend=backend) is None
+        with pytest.raises(ValueError):
+            lab.actor_path(db_small, 4724, backend=backend, level_goal_function=set)
+        with pytest.raises(ValueError):
+            lab.actor_path(db_small, 4724, lambda p: False, backend=backend, max_depth=2)
+
+
+def test_actor_path_limits():
+    two = lab.actors_with_bacon_number(db_small, 2)
+    three = lab.actors_with_bacon_number(db_small, 3)
+
+    # depth limit
+    assert lab.actor_path(db_small, 4724, lambda p: p in three, max_depth=2) is None
+    check_valid_path(raw_db_small, lab.actor_path(db_small, 4724, lambda p: p in three, max_depth=3), 4724, None, 3)
+
+    # level goals see each whole level, and the first match in it is used
+    levels = []
+    def level_goal(level):
+        levels.append(set(level))
+        return three.intersection(level)
+    result = lab.actor_path(db_small, 4724, level_goal_function=level_goal)
+    check_valid_path(raw_db_small, result, 4724, None, 3)
+    assert result[-1] in three
+    assert levels == [{4724}] + [lab.actors_with_bacon_number(db_small, n) for n in (1, 2, 3)]
+
+    # filtered actors are never used
+    result = lab.actor_path(db_small, 4724, lambda p: p == 46866, node_filter=lambda p: p not in two)
+    assert result is None
+
+    # budget on the number of expanded actors
+    assert lab.actor_path(db_small, 4724, lambda p: p in three, max_expanded=1) is None
+    assert lab.actor_path(db_small, 4724, lambda p: p in three, max_expanded=10**6) is not None
+
+
+def test_graph_analytics():
+    import analytics
+    labels, sizes = analytics.connected_components(db_small)
+    assert sum(sizes) == len(db_small["actors"])
+    assert list(sizes) == sorted(sizes, reverse=True)
+
+    # every actor reachable from Bacon is in his component, and nobody else
+    index = lab.build_bacon_index(db_small)
+    bacon = labels[lab.actor_index(db_small, lab.KEVIN_BACON)]
+    assert sizes[bacon] == len(index["order"])
+    assert all((labels[i] == bacon) == (index["distance"][i] != -1)
+               for i in range(len(labels)))
+
+    histogram = analytics.degree_distribution(db_small)
+    assert sum(histogram) == len(db_small["actors"])
+    assert sum(d * c for d, c in enumerate(histogram)) == len(db_small["neighbors"])
+
+    # a path of four actors has diameter 3
+    path = lab.transform_data([(1, 2, 10), (2, 3, 11), (3, 4, 12)])
+    result = analytics.sample_eccentricities(path, samples=4)
+    assert result["diameter_lower_bound"] == 3
+    assert result["diameter_upper_bound"] >= 3
+
+    # by default only the largest component is sampled, so a smaller one
+    # cannot lower the upper bound below its diameter
+    long_path = lab.transform_data([(i, i + 1, 100 + i) for i in range(1, 20)] + [(50, 51, 200)])
+    for component in (None, (analytics.connected_components(long_path)[0], 0)):
+        result = analytics.sample_eccentricities(long_path, samples=8, component=component)
+        assert result["diameter_lower_bound"] == 19
+        assert result["diameter_upper_bound"] >= 19
+
+
+def test_incremental_updates(tmp_path):
+    import snapshot
+    movies = sorted({movie for _, _, movie in raw_db_small})
+    bacon_movie = next(movie for a1, a2, movie in raw_db_small if lab.KEVIN_BACON in (a1, a2))
+    later = {bacon_movie, movies[0], movies[-1]}
+    before = [i for i in raw_db_small if i[2] not in later]
+    after = [i for i in raw_db_small if i[2] in later]
+
+    # start from a read-only snapshot with a Bacon index
+    snapshot.save_graph(lab.transform_data(before), tmp_path / 'small.graph')
+    data = snapshot.load_graph(tmp_path / 'small.graph')
+    lab.bacon_index(data)
+
+    lab.add_credits(data, after)
+    expected = lab.transform_data(raw_db_small)
+    for name in expected:
+        assert list(data[name]) == list(expected[name])
+    for n in range(6):
+        assert lab.actors_with_bacon_number(data, n) == lab.actors_with_bacon_number(expected, n)
+
+    lab.remove_movies(data, later)
+    expected = lab.transform_data(before)
+    for n in range(6):
+        assert lab.actors_with_bacon_number(data, n) == lab.actors_with_bacon_number(expected, n)
+    assert lab.movie_cast(data, bacon_movie) == []
+    for actor_id in (46866, 1640, 9210):
+        assert len(lab.bacon_path(data, actor_id) or []) == len(lab.bacon_path(expected, actor_id) or [])
+
+
+def test_name_index():
+    with open(os.path.join(TEST_DIRECTORY, 'resources', 'names.pickle'), 'rb') as f:
+        names = pickle.load(f)
+    index = lab.build_name_index(names)
+
+    assert lab.actor_id_from_name(index, 'Kevin Bacon') == 4724
+    assert lab.actor_id_from_name(index, 'kevin BACON') is None
+    assert lab.actor_id_from_name(index, 'kevin BACON', ignore_case=True) == 4724
+    assert lab.actor_name(index, 4724) == 'Kevin Bacon'
+    assert lab.actor_name(index, -1) is None
+
+    for prefix in ('Kevin B', 'kevin b', 'Z', 'Qqqq'):
+        for ignore_case in (False, True):
+            fold = str.casefold if ignore_case else str
+            expected = sorted((name, i) for name, i in names.items()
+                              if fold(name).startswith(fold(prefix)))
+            result = lab.actors_with_name_prefix(index, prefix, ignore_case)
+            assert sorted(result) == expected
+    assert len(lab.actors_with_name_prefix(index, 'A', limit=3)) == 3
+
 
 def random_number_list(L, i=1):
     o = list(range(i*100000, i*100000+L))
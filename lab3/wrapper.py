@@ -1,6 +1,7 @@
-import lab, pickle, traceback, time
+import lab, snapshot, traceback, time, pickle
 from importlib import reload
 reload(lab)  # this forces the student code to be reloaded when page is refreshed
+reload(snapshot)
 
 
 def run_test(input_data):
@@ -44,18 +45,51 @@ def bacon_path(d):
     return lab.bacon_path(small_data, d["actor_name"])
 
 
+def movie_path(d):
+    return lab.movie_path(small_data, d["actor_1"], d["actor_2"])
+
+
+def actor_paths(d):
+    return path_cache.paths(d["pairs"])
+
+
+def actor_id(d):
+    return lab.actor_id_from_name(name_index, d["name"], d.get("ignore_case", True))
+
+
+def name_suggestions(d):
+    return lab.actors_with_name_prefix(name_index, d["prefix"], d.get("ignore_case", True),
+                                       d.get("limit", 10))
+
+
+def cache_stats(d):
+    return {"trees": len(path_cache.trees), "bytes": path_cache.size,
+            "hits": path_cache.hits, "misses": path_cache.misses,
+            "hit_rate": path_cache.hit_rate()}
+
+
 # State that is used by both ui and test code
 small_data = None
 large_data = None
+path_cache = None
+name_index = None
 
 
 ## Initialization
 def init():
     global small_data
     global large_data
-    with open('./resources/small.pickle', 'rb') as f:
-            small_data = lab.transform_data(pickle.load(f))
-    with open('./resources/large.pickle', 'rb') as f:
-            large_data = lab.transform_data(pickle.load(f))
+    global path_cache
+    global name_index
+    # the transformed graphs, and the Bacon-number index of the large one,
+    # are memory-mapped from binary snapshots, which are (re)built from the
+    # raw pickles only when those change
+    small_data = snapshot.load_or_convert('./resources/small.pickle')
+    large_data = snapshot.load_or_convert('./resources/large.pickle', bacon_index=True)
+    path_cache = lab.PathCache(large_data)
+    # names typed by users are resolved with binary searches instead of
+    # scanning names.pickle on every request
+    with open('./resources/names.pickle', 'rb') as f:
+        name_index = lab.build_name_index(pickle.load(f))
 
 init()
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+Contraction hierarchies over the road network built by
+lab.build_auxiliary_structures, for answering many route queries on the same
+map quickly.
+
+Preprocessing ranks the nodes by importance and removes ("contracts") them
+from least to most important.  Whenever removing a node v would lengthen the
+shortest path between two of its remaining neighbors u and w, a shortcut edge
+u -> w, standing for u -> v -> w, is added.  A query then only has to search
+upward in rank: forward from the start and backward from the goal, until the
+two searches meet.  Shortcuts on the resulting path are unpacked back into
+the original nodes.
+
+A hierarchy is built for one metric: "distance" (the cost used by
+lab.find_short_path_nodes) or "time" (the one used by lab.find_fast_path).
+
+Example usage:
+    hierarchy = build_hierarchy(aux, "distance")
+    lab.save_preprocessed(hierarchy, 'resources/cambridge.distance.ch', aux)
+    path = hierarchy_path_nodes(aux, hierarchy, node1, node2)
+
+Running this file directly builds and saves both hierarchies for a dataset,
+and compares query times with the plain search:
+    python3 contraction.py cambridge
+"""
+import sys
+import time
+import heapq
+import random
+from array import array
+
+import lab
+
+
+def witness_costs(out_edges, source, skip, limit, settle_limit):
+    """
+    Return a dictionary of the costs of the shortest paths from source to
+    the nodes around it in the current (partly contracted) graph, avoiding
+    the node skip.  The search stops at cost limit or after settling
+    settle_limit nodes, so costs it does not find may still exist.
+    """
+    costs = {source: 0}
+    agenda = [(0, source)]
+    settled = 0
+
+    while agenda and settled < settle_limit:
+        cost, node = heapq.heappop(agenda)
+        if cost > costs[node]:
+            continue
+        if cost > limit:
+            break
+        settled += 1
+
+        for child, (edge_cost, _) in out_edges[node].items():
+            if child != skip and cost + edge_cost < costs.get(child, float("inf")):
+                costs[child] = cost + edge_cost
+                heapq.heappush(agenda, (cost + edge_cost, child))
+
+    return costs
+
+
+def shortcuts(out_edges, in_edges, v, settle_limit):
+    """
+    Return the list of (u, w, cost) shortcuts needed to contract node v: one
+    for each remaining path u -> v -> w that is shorter than any path from u
+    to w avoiding v.
+    """
+    result = []
+
+    for u, (in_cost, _) in in_edges[v].items():
+        via = {w: in_cost + out_cost for w, (out_cost, _) in out_edges[v].items() if w != u}
+        if not via:
+            continue
+
+        witness = witness_costs(out_edges, u, v, max(via.values()), settle_limit)
+        for w, cost in via.items():
+            if witness.get(w, float("inf")) > cost:
+                result.append((u, w, cost))
+
+    return result
+
+
+def build_hierarchy(aux, metric="distance", settle_limit=50):
+    """
+    Contract every node of the road network in aux, returning the hierarchy
+    for the given metric ("distance" or "time") as a dictionary with:
+        "metric", "nodes": the metric, and the number of nodes of aux
+        "rank": array of the order in which each node index was contracted
+        "up_offsets", "up_targets", "up_costs", "up_middles": for each node,
+            in compressed sparse row form, its edges to higher ranked nodes
+        "down_offsets", "down_targets", "down_costs", "down_middles": for
+            each node, the edges from higher ranked nodes into it (listed by
+            their source)
+    The middle of an edge is the node its shortcut skips over, or -1 for an
+    original edge of the map.
+
+    Nodes are contracted in order of twice their edge difference (shortcuts
+    added minus edges removed) plus the number of their neighbors already
+    contracted, which keeps the hierarchy small and spread out.  Priorities
+    are updated lazily, when a node comes up to be contracted.
+    """
+    size = len(aux["ids"])
+    offsets, targets = aux["offsets"], aux["targets"]
+    costs = lab.edge_costs(aux, metric)
+
+    # edges of the remaining graph: {neighbor: (cost, middle)} per node
+    out_edges = [{targets[k]: (costs[k], -1)
+                  for k in range(offsets[i], offsets[i + 1]) if targets[k] != i}
+                 for i in range(size)]
+    in_edges = [{} for _ in range(size)]
+    for i, edges in enumerate(out_edges):
+        for j, edge in edges.items():
+            in_edges[j][i] = edge
+
+    contracted_neighbors = array("i", [0]) * size
+
+    def priority(v):
+        removed = len(out_edges[v]) + len(in_edges[v])
+        return (2 * (len(shortcuts(out_edges, in_edges, v, settle_limit)) - removed)
+                + contracted_neighbors[v])
+
+    agenda = [(priority(v), v) for v in range(size)]
+    heapq.heapify(agenda)
+
+    rank = array("i", [-1]) * size
+    up = [None] * size
+    down = [None] * size
+    contracted = 0
+
+    while agenda:
+        _, v = heapq.heappop(agenda)
+        if rank[v] != -1:
+            continue
+
+        # lazy update: put v back if it is no longer the best choice
+        current = priority(v)
+        if agenda and current > agenda[0][0]:
+            heapq.heappush(agenda, (current, v))
+            continue
+
+        for u, w, cost in shortcuts(out_edges, in_edges, v, settle_limit):
+            if cost < out_edges[u].get(w, (float("inf"),))[0]:
+                out_edges[u][w] = in_edges[w][u] = (cost, v)
+
+        rank[v] = contracted
+        contracted += 1
+
+        # the edges v has left all lead to or from higher ranked nodes
+        up[v], down[v] = out_edges[v], in_edges[v]
+        for w in out_edges[v]:
+            del in_edges[w][v]
+            contracted_neighbors[w] += 1
+        for u in in_edges[v]:
+            del out_edges[u][v]
+            contracted_neighbors[u] += 1
+        out_edges[v] = in_edges[v] = {}
+
+    hierarchy = {"metric": metric, "nodes": size, "rank": rank}
+    for name, edges in (("up", up), ("down", down)):
+        offsets = array("i", [0]) * (size + 1)
+        targets, costs, middles = array("i"), array("d"), array("i")
+        for v in range(size):
+            for w, (cost, middle) in sorted(edges[v].items()):
+                targets.append(w)
+                costs.append(cost)
+                middles.append(middle)
+            offsets[v + 1] = len(targets)
+        hierarchy.update({name + "_offsets": offsets, name + "_targets": targets,
+                          name + "_costs": costs, name + "_middles": middles})
+
+    return hierarchy
+
+
+def hierarchy_path_nodes(aux, hierarchy, node1, node2):
+    """
+    Return the least costly path (under the hierarchy's metric) between the
+    two node IDs as a list of node IDs, or None if there is none, like
+    lab.find_short_path_nodes does for the "distance" metric.
+
+    Two searches, forward from node1 and backward from node2, take turns
+    settling one node each, only ever following edges to higher ranked
+    nodes.  They stop once neither can improve on the best meeting point
+    found so far.
+    """
+    index = aux["index"]
+    start, goal = index.get(node1), index.get(node2)
+
+    if start is None or goal is None:
+        return [node1] if node1 == node2 else None
+
+    # state of the forward (0) and backward (1) searches
+    graphs = (edges(hierarchy, "up"), edges(hierarchy, "down"))
+    costs = ({start: 0}, {goal: 0})
+    parents = ({start: start}, {goal: goal})
+    agendas = ([(0, start)], [(0, goal)])
+    best = float("inf")
+    meet = None
+
+    while any(agenda and agenda[0][0] < best for agenda in agendas):
+        for side in (0, 1):
+            agenda = agendas[side]
+            if not agenda or agenda[0][0] >= best:
+                continue
+
+            cost, node = heapq.heappop(agenda)
+            if cost > costs[side][node]:
+                continue
+
+            # a path through node, using the other side's cost so far
+            if node in costs[1 - side] and cost + costs[1 - side][node] < best:
+                best = cost + costs[1 - side][node]
+                meet = node
+
+            offsets, targets, edge_costs = graphs[side]
+            for k in range(offsets[node], offsets[node + 1]):
+                child = targets[k]
+                if cost + edge_costs[k] < costs[side].get(child, float("inf")):
+                    costs[side][child] = cost + edge_costs[k]
+                    parents[side][child] = node
+                    heapq.heappush(agenda, (cost + edge_costs[k], child))
+
+    if meet is None:
+        return None
+
+    # path in the hierarchy from start up to the meeting point and back down
+    path = [meet]
+    while parents[0][path[-1]] != path[-1]:
+        path.append(parents[0][path[-1]])
+    path.reverse()
+    while parents[1][path[-1]] != path[-1]:
+        path.append(parents[1][path[-1]])
+
+    return [aux["ids"][i] for i in unpack_path(hierarchy, path)]
+
+
+def edges(hierarchy, name):
+    """
+    Return the (offsets, targets, costs) arrays of the "up" or "down" edges
+    of a hierarchy.
+    """
+    return hierarchy[name + "_offsets"], hierarchy[name + "_targets"], hierarchy[name + "_costs"]
+
+
+def edge_middle(hierarchy, u, w):
+    """
+    Return the middle node of the hierarchy's edge from u to w (-1 if it is
+    an edge of the map itself).  The edge is stored with whichever of its
+    ends was contracted first.
+    """
+    if hierarchy["rank"][u] < hierarchy["rank"][w]:
+        name, node, other = "up", u, w
+    else:
+        name, node, other = "down", w, u
+
+    offsets, targets = hierarchy[name + "_offsets"], hierarchy[name + "_targets"]
+    for k in range(offsets[node], offsets[node + 1]):
+        if targets[k] == other:
+            return hierarchy[name + "_middles"][k]
+
+    raise KeyError((u, w))
+
+
+def unpack_path(hierarchy, path):
+    """
+    Replace every shortcut on a path of node indices by the nodes it skips
+    over, returning the path through the original map.
+    """
+    result = [path[0]]
+    # edges still to unpack, the next one at the end
+    stack = list(zip(path, path[1:]))[::-1]
+
+    while stack:
+        u, w = stack.pop()
+        middle = edge_middle(hierarchy, u, w)
+        if middle == -1:
+            result.append(w)
+        else:
+            stack.append((middle, w))
+            stack.append((u, middle))
+
+    return result
+
+
+def benchmark(aux, hierarchies, queries):
+    """
+    Time the given (node1, node2) queries with the plain search and with
+    each hierarchy, returning a list of (metric, plain seconds per query,
+    hierarchy seconds per query) tuples.
+    """
+    results = []
+
+    for metric, hierarchy in hierarchies.items():
+        cost_function, heuristic = lab.metric_functions(metric)
+
+        start = time.time()
+        for node1, node2 in queries:
+            lab.find_path_nodes(aux, node1, node2, cost_function, heuristic)
+        plain = (time.time() - start) / len(queries)
+
+        start = time.time()
+        for node1, node2 in queries:
+            hierarchy_path_nodes(aux, hierarchy, node1, node2)
+        results.append((metric, plain, (time.time() - start) / len(queries)))
+
+    return results
+
+
+if __name__ == '__main__':
+    dataset = sys.argv[1] if len(sys.argv) > 1 else 'cambridge'
+    aux = lab.build_auxiliary_structures(f'resources/{dataset}.nodes', f'resources/{dataset}.ways')
+    hierarchies = {}
+
+    for metric in lab.METRICS:
+        start = time.time()
+        hierarchies[metric] = build_hierarchy(aux, metric)
+        lab.save_preprocessed(hierarchies[metric], f'resources/{dataset}.{metric}.ch', aux)
+        print('%s hierarchy: %d shortcuts, built in %.1f seconds' % (
+            metric, sum(i != -1 for i in hierarchies[metric]["up_middles"])
+            + sum(i != -1 for i in hierarchies[metric]["down_middles"]), time.time() - start))
+
+    rng = random.Random(6009)
+    queries = [(rng.choice(aux["ids"]), rng.choice(aux["ids"])) for _ in range(50)]
+    for metric, plain, fast in benchmark(aux, hierarchies, queries):
+        print('%8s: %.2f ms per query with A*, %.2f ms with the hierarchy' % (
+            metric, plain * 1000, fast * 1000))
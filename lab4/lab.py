@@ -1,8 +1,15 @@
 #!/usr/bin/env python3
 
+import os
+import math
+import heapq
+import pickle
+from array import array
+
 from util import great_circle_distance, read_osm_data, to_local_kml_url
+from osm_loader import read_node_locations
 
-# NO ADDITIONAL IMPORTS!
+# Standard library imports only, plus the helper modules in this directory.
 
 
 ALLOWED_HIGHWAY_TYPES = {
@@ -29,90 +36,164 @@ DEFAULT_SPEED_LIMIT_MPH = {
 }
 
 
-def build_auxiliary_structures(nodes_filename, ways_filename):
+def build_auxiliary_structures(nodes_filename, ways_filename, workers=1):
     """
     Create any auxiliary structures you are interested in, by reading the data
     from the given filenames (using read_osm_data)
+
+    Nodes on some way are numbered with compact indices, in the order they
+    are first seen, and everything stored per node is kept in flat arrays
+    by index rather than in a dictionary per node.
+
+    The road network is stored as a directed graph in compressed sparse row
+    form: the edges leaving the node at index i are at positions
+    offsets[i]..offsets[i + 1] - 1 of the targets, distances and speeds
+    arrays.  There is one edge between each pair of consecutive nodes of a
+    way (and one back, unless the way is one-way), and if several ways join
+    the same two nodes, the highest speed limit among them is used.
+
+    Node locations are read by the given number of worker processes (None
+    for one per CPU), see osm_loader.read_node_locations; with more than one,
+    call this behind an if __name__ == '__main__' guard.
     """
 
-    # nodes: dict - {node_id : {ways: (list), lat: (float), lon: (float)}}
-    # ways: dict - {way_id : {nodes: (list), oneway: (bool), maxspeed_mph: (int)}}
-    nodes = {}
-    ways = {}
+    # index: dict - {node_id : compact index}
+    # ids: array - node ID of each index
+    # lat, lon: arrays - location of each index
+    # offsets, targets, distances, speeds: arrays - edges, as above
+    # max_speed: highest speed limit on any edge, for the fast path heuristic
+    # sources: the nodes and ways filenames, to check saved preprocessing
+    index = {}
+    # for each index, {child index: speed limit} in the order edges are found
+    children = []
+
+    def node_index(node):
+        if node not in index:
+            index[node] = len(children)
+            children.append({})
+
+        return index[node]
+
+    def add_edge(i, j, speed):
+        if children[i].get(j, -1) < speed:
+            children[i][j] = speed
 
     for way in read_osm_data(ways_filename):
         if "highway" in way["tags"]:
 
             if way["tags"]["highway"] in ALLOWED_HIGHWAY_TYPES:
 
-                ways[way["id"]] = {"nodes": way["nodes"]}
+                oneway = way["tags"].get("oneway", "no") != "no"
+                speed = way["tags"].get(
+                    "maxspeed_mph", DEFAULT_SPEED_LIMIT_MPH[way["tags"]["highway"]])
+                way_nodes = [node_index(node) for node in way["nodes"]]
 
-                if way["tags"].get("oneway", "no") == "no":
-                    ways[way["id"]]["oneway"] = False
-                else:
-                    ways[way["id"]]["oneway"] = True
+                # every occurrence of a node on the way connects it to the
+                # nodes right before and after it
+                for k, i in enumerate(way_nodes):
+                    if k + 1 < len(way_nodes):
+                        add_edge(i, way_nodes[k + 1], speed)
 
-                ways[way["id"]]["maxspeed_mph"] = way["tags"].get(
-                    "maxspeed_mph", DEFAULT_SPEED_LIMIT_MPH[way["tags"]["highway"]])
+                    if not oneway and k > 0:
+                        add_edge(i, way_nodes[k - 1], speed)
 
-                # append way on which node is present
+    size = len(children)
+    ids = array("q", [0]) * size
 
-                for node in way["nodes"]:
-                    nodes.setdefault(node, {}).setdefault(
-                        "ways", []).append(way["id"])
+    for node, i in index.items():
+        ids[i] = node
 
-    for node in read_osm_data(nodes_filename):
-        # only use nodes which are on some way
+    # only use nodes which are on some way
+    lat, lon = read_node_locations(nodes_filename, index, workers)
 
-        if node["id"] in nodes:
-            nodes[node["id"]]["lat"] = node["lat"]
-            nodes[node["id"]]["lon"] = node["lon"]
+    offsets = array("i", [0]) * (size + 1)
+    targets = array("i")
+    distances = array("d")
+    speeds = array("d")
 
-    return nodes, ways
+    for i, edges in enumerate(children):
+        for j, speed in edges.items():
+            # edges to nodes missing from the nodes file cannot be measured
+            if lat[i] == lat[i] and lat[j] == lat[j]:
+                targets.append(j)
+                distances.append(great_circle_distance((lat[i], lon[i]), (lat[j], lon[j])))
+                speeds.append(speed)
+        offsets[i + 1] = len(targets)
 
+    return {"index": index, "ids": ids, "lat": lat, "lon": lon,
+            "offsets": offsets, "targets": targets,
+            "distances": distances, "speeds": speeds,
+            "max_speed": max(speeds, default=1),
+            "grid": build_grid(lat, lon),
+            "sources": (nodes_filename, ways_filename)}
 
-def get_children(node, aux_structures):
+
+def build_grid(lat, lon, per_cell=4):
     """
-    Get children (nodes adjacent) of given node.
+    Build a spatial index over the given node locations: a uniform grid of
+    square lat/lon cells over their bounding box, sized to hold about
+    per_cell nodes each on average.
+
+    Returns a dictionary with the position ("lat0", "lon0") of the corner of
+    the grid, the cell "size" in degrees, the number of "rows" and "cols",
+    and the node indices of each cell in compressed sparse row form: the
+    nodes in cell row * cols + col are cell_nodes[cell_offsets[cell]:
+    cell_offsets[cell + 1]].  Nodes without a location are left out.
+    """
+    located = [i for i in range(len(lat)) if lat[i] == lat[i]]
 
-    Parameters:
-        node: given node
-        aux_structures: result of calling build_auxiliary_structures
+    lat0 = min((lat[i] for i in located), default=0)
+    lon0 = min((lon[i] for i in located), default=0)
+    height = max((lat[i] for i in located), default=0) - lat0
+    width = max((lon[i] for i in located), default=0) - lon0
 
-    Returns:
-        dictionary of children with values as maxspeed_mph from node to child.
-    """
-    nodes, ways = aux_structures
+    size = ((height * width) / max(len(located) // per_cell, 1)) ** 0.5 or max(height, width, 1e-6)
+    rows = int(height / size) + 1
+    cols = int(width / size) + 1
 
-    children = {}
+    cells = [int((lat[i] - lat0) / size) * cols + int((lon[i] - lon0) / size)
+             for i in located]
 
-    def add_child(idx, way_id):
-        child = ways[way_id]["nodes"][idx]
-        speed = ways[way_id]["maxspeed_mph"]
+    # counting sort of the nodes by cell
+    cell_offsets = array("i", [0]) * (rows * cols + 1)
+    for cell in cells:
+        cell_offsets[cell + 1] += 1
+    for cell in range(rows * cols):
+        cell_offsets[cell + 1] += cell_offsets[cell]
 
-        if (child not in children) or (child in children and children[child] < speed):
-            children[child] = speed
+    cell_nodes = array("i", [0]) * len(located)
+    filled = array("i", cell_offsets)
+    for i, cell in zip(located, cells):
+        cell_nodes[filled[cell]] = i
+        filled[cell] += 1
 
-    # ways at which given node is present
-    neighbor_ways = nodes[node]["ways"]
+    return {"lat0": lat0, "lon0": lon0, "size": size, "rows": rows, "cols": cols,
+            "cell_offsets": cell_offsets, "cell_nodes": cell_nodes}
 
-    for way_id in neighbor_ways:
-        # append next node to children if it exists
-        nxt_idx = ways[way_id]["nodes"].index(node) + 1
 
-        if nxt_idx < len(ways[way_id]["nodes"]):
-            add_child(nxt_idx, way_id)
+def get_children(node, aux_structures):
+    """
+    Get children (nodes adjacent) of given node.
 
-        # append previous node to children if path is not oneway
+    Parameters:
+        node: given node
+        aux_structures: result of calling build_auxiliary_structures
 
-        if not ways[way_id]["oneway"]:
+    Returns:
+        dictionary of children with values as maxspeed_mph from node to child.
+    """
+    i = aux_structures["index"][node]
+    ids, targets, speeds = aux_structures["ids"], aux_structures["targets"], aux_structures["speeds"]
 
-            prev_idx = ways[way_id]["nodes"].index(node) - 1
+    return {ids[targets[k]]: speeds[k]
+            for k in range(aux_structures["offsets"][i], aux_structures["offsets"][i + 1])}
 
-            if prev_idx >= 0:
-                add_child(prev_idx, way_id)
 
-    return children
+def location(aux_structures, i):
+    """
+    Return the (latitude, longitude) of the node at index i.
+    """
+    return aux_structures["lat"][i], aux_structures["lon"][i]
 
 
 def compute_distance(node1, node2, aux_structures):
@@ -127,9 +208,9 @@ def compute_distance(node1, node2, aux_structures):
     Returns:
         (float) distance b/w node1 and node2
     """
-    nodes, _ = aux_structures
-    loc1 = (nodes[node1]["lat"], nodes[node1]["lon"])
-    loc2 = (nodes[node2]["lat"], nodes[node2]["lon"])
+    index = aux_structures["index"]
+    loc1 = location(aux_structures, index[node1])
+    loc2 = location(aux_structures, index[node2])
 
     dist = great_circle_distance(loc1, loc2)
 
@@ -157,30 +238,93 @@ def compute_time(node1, node2, aux_structures, children):
     return time
 
 
-def sort_by_cost(aux_structures, agenda, node2, heuristic=False):
+def distance_heuristic(node, goal, aux_structures):
+    """
+    Lower bound on the distance from node to goal: no road between them can
+    be shorter than the great circle distance.
     """
-    Sorts given agenda by cost.
+    return compute_distance(node, goal, aux_structures)
 
-    Parameters:
-        aux_structures: result of calling build_aux_structures
-        agenda: given list to sort
-        node2: goal node
-        heuristic: if True, uses heuristic + cost as total cost for sorting
 
-    Returns:
-        new sorted list.
+def time_heuristic(node, goal, aux_structures):
+    """
+    Lower bound on the time to get from node to goal: the great circle
+    distance between them, covered at the highest speed limit of any way.
+    """
+    return compute_distance(node, goal, aux_structures) / aux_structures["max_speed"]
+
+
+# cost function and great circle heuristic of each metric a search can use
+METRICS = {
+    "distance": (compute_distance, distance_heuristic),
+    "time": (compute_time, time_heuristic),
+}
+
+
+def metric_functions(metric):
+    """
+    Return the tuple (cost_function, heuristic) for searching by the given
+    metric ("distance" or "time"), to pass to find_path_nodes.
+    """
+    if metric not in METRICS:
+        raise ValueError('unknown metric %r' % (metric,))
+
+    return METRICS[metric]
+
+
+def edge_costs(aux_structures, metric):
+    """
+    Return an array with the cost of every edge of aux_structures (in the
+    order of aux_structures["targets"]) under the given metric, as
+    find_path_nodes adds them up.
     """
+    metric_functions(metric)
+    if metric == "distance":
+        return array("d", aux_structures["distances"])
+
+    return array("d", [d / s for d, s in zip(aux_structures["distances"],
+                                              aux_structures["speeds"])])
+
 
-    if not heuristic:
-        return sorted(agenda, key=lambda x: x[0])
+def source_stamps(aux_structures):
+    """
+    Return a list with the size and modification time of each of the files
+    aux_structures was read from.
+    """
+    return [(os.stat(name).st_size, os.stat(name).st_mtime_ns)
+            for name in aux_structures["sources"]]
+
+
+def save_preprocessed(data, filename, aux_structures):
+    """
+    Write data computed ahead of time for the map in aux_structures (a
+    dictionary whose "nodes" entry is the number of nodes of the map, such as
+    a contraction hierarchy or a set of landmarks) to filename, tagged with
+    the size and modification time of the files the map was read from.
+    """
+    with open(filename, "wb") as f:
+        pickle.dump({"sources": source_stamps(aux_structures), "data": data}, f)
+
+
+def load_preprocessed(filename, aux_structures):
+    """
+    Load data saved by save_preprocessed, checking that it was computed from
+    the same, unchanged map files as aux_structures, with the same number of
+    nodes.  Raises ValueError otherwise, since a hierarchy or landmarks from
+    an edited map would give wrong routes.
+    """
+    with open(filename, "rb") as f:
+        saved = pickle.load(f)
 
-    def h(node1, node2):
-        return compute_distance(node1, node2, aux_structures)
+    if (saved.get("sources") != source_stamps(aux_structures)
+            or saved["data"].get("nodes") != len(aux_structures["ids"])):
+        raise ValueError('%r was built for a different map' % filename)
 
-    return sorted(agenda, key=lambda x: x[0] + h(x[1], node2))
+    return saved["data"]
 
 
-def find_path_nodes(aux_structures, node1, node2, cost_function):
+def find_path_nodes(aux_structures, node1, node2, cost_function,
+                    heuristic=None, stats=None):
     """
     Return the least costly path between the two nodes
 
@@ -188,42 +332,98 @@ def find_path_nodes(aux_structures, node1, node2, cost_function):
         aux_structures: the result of calling build_auxiliary_structures
         node1: node representing the start location
         node2: node representing the end location
+        cost_function: compute_distance or compute_time
+        heuristic: optional lower bound on the cost from a node to node2,
+                   called as heuristic(node, node2, aux_structures) at most
+                   once per node; e.g. distance_heuristic or time_heuristic
+        stats: optional dictionary, in which the number of nodes that were
+               expanded is stored under "expanded"
 
     Returns:
         a list of node IDs representing the least costly path (in terms of
-        distance) from node1 to node2
+        cost_function) from node1 to node2
     """
-    expanded = set()
-    agenda = [(0, node1, [node1])]
-
-    while len(agenda) != 0:
-        # pop lowest cost path from agenda
-        cost, node, path = sort_by_cost(
-            aux_structures, agenda, node2, False)[0]
-        del agenda[agenda.index((cost, node, path))]
-
-        if node in expanded:
-            continue
+    index, ids = aux_structures["index"], aux_structures["ids"]
+    start, goal = index.get(node1), index.get(node2)
 
-        # return path if current node is goal
+    if start is None or goal is None:
+        return [node1] if node1 == node2 else None
 
-        if node == node2:
-            return path
-        # else ready to expand it
-        expanded.add(node)
+    # the search works on node indices and only keeps each node's parent and
+    # best cost so far; the path is rebuilt once the goal is reached
+    expanded = set()
+    parent = {start: start}
+    best = {start: 0}
+    # heuristic value of each node seen so far
+    estimates = {}
+
+    def estimate(i):
+        if heuristic is None:
+            return 0
+        if i not in estimates:
+            estimates[i] = heuristic(ids[i], node2, aux_structures)
+
+        return estimates[i]
+
+    offsets, targets = aux_structures["offsets"], aux_structures["targets"]
+    distances, speeds = aux_structures["distances"], aux_structures["speeds"]
+    by_time = cost_function != compute_distance
+
+    # the agenda is a binary heap of (cost + heuristic, count, cost, node)
+    # tuples; count breaks ties in the order entries were added
+    agenda = [(estimate(start), 0, 0, start)]
+    count = 1
+
+    try:
+        while agenda:
+            # pop lowest cost node from agenda
+            _, _, cost, i = heapq.heappop(agenda)
+
+            # entries for nodes that were reached more cheaply since they were
+            # added are skipped here rather than removed from the heap
+            if i in expanded:
+                continue
+
+            # return path if current node is goal
+
+            if i == goal:
+                return path_from_parents(aux_structures, parent, i)
+            # else ready to expand it
+            expanded.add(i)
+
+            for k in range(offsets[i], offsets[i + 1]):
+                child = targets[k]
+
+                if child not in expanded:
+                    if by_time:
+                        new_cost = cost + distances[k] / speeds[k]
+                    else:
+                        new_cost = cost + distances[k]
+
+                    if child not in best or new_cost < best[child]:
+                        best[child] = new_cost
+                        parent[child] = i
+                        heapq.heappush(agenda, (new_cost + estimate(child), count,
+                                                new_cost, child))
+                        count += 1
+    finally:
+        if stats is not None:
+            stats["expanded"] = len(expanded)
+
+
+def path_from_parents(aux_structures, parent, i):
+    """
+    Follow parent pointers from the node at index i back to the start of the
+    search (the node that is its own parent), returning the path from the
+    start to i as a list of node IDs.
+    """
+    path = [i]
 
-        children = get_children(node, aux_structures)
+    while parent[path[-1]] != path[-1]:
+        path.append(parent[path[-1]])
+    path.reverse()
 
-        for child in children:
-            if child not in expanded:
-                if cost_function == compute_distance:
-                    add_cost = cost_function(node, child, aux_structures)
-                else:
-                    add_cost = cost_function(
-                        node, child, aux_structures, children)
-                new_path = path.copy() + [child]
-                new_cost = cost + add_cost
-                agenda.append((new_cost, child, new_path))
+    return [aux_structures["ids"][i] for i in path]
 
 
 def find_short_path_nodes(aux_structures, node1, node2):
@@ -240,7 +440,8 @@ def find_short_path_nodes(aux_structures, node1, node2):
         distance) from node1 to node2
     """
 
-    return find_path_nodes(aux_structures, node1, node2, compute_distance)
+    return find_path_nodes(aux_structures, node1, node2, compute_distance,
+                           distance_heuristic)
 
 
 def nearest_nodes(aux_structures, *locs):
@@ -255,21 +456,84 @@ def nearest_nodes(aux_structures, *locs):
         list of nearest nodes.
     """
 
-    nodes, _ = aux_structures
+    return [nearest_node(aux_structures, loc) for loc in locs]
+
 
-    nearest = {loc: {"node": None, "dist": 1e10} for loc in locs}
+def nearest_node(aux_structures, loc):
+    """
+    Return the ID of the node closest to loc (by great circle distance), or
+    None if there are no nodes.
+
+    The grid cells around loc are searched in square rings of increasing
+    size, until the closest node found so far is nearer than anything
+    outside the cells searched could be.  Ties go to the lowest node index.
+    """
+    grid = aux_structures["grid"]
+    lat0, lon0, size = grid["lat0"], grid["lon0"], grid["size"]
+    rows, cols = grid["rows"], grid["cols"]
+    cell_offsets, cell_nodes = grid["cell_offsets"], grid["cell_nodes"]
+
+    # cell containing loc, moved onto the grid if loc is outside of it
+    row = min(max(int((loc[0] - lat0) // size), 0), rows - 1)
+    col = min(max(int((loc[1] - lon0) // size), 0), cols - 1)
+
+    best = None
+
+    for ring in range(max(rows, cols)):
+        for r in range(row - ring, row + ring + 1):
+            if not 0 <= r < rows:
+                continue
+
+            # the whole row of cells at the top and bottom of the ring, and
+            # the two cells at its sides in between
+            if abs(r - row) == ring:
+                ring_cols = range(max(col - ring, 0), min(col + ring, cols - 1) + 1)
+            else:
+                ring_cols = [c for c in (col - ring, col + ring) if 0 <= c < cols]
+
+            for c in ring_cols:
+                cell = r * cols + c
+                for i in cell_nodes[cell_offsets[cell]:cell_offsets[cell + 1]]:
+                    candidate = (great_circle_distance(loc, location(aux_structures, i)), i)
+                    if best is None or candidate < best:
+                        best = candidate
+
+        if best is not None and best[0] < outside_distance(grid, loc, row, col, ring):
+            break
+
+    return None if best is None else aux_structures["ids"][best[1]]
+
+
+def outside_distance(grid, loc, row, col, ring):
+    """
+    Return a lower bound on the great circle distance from loc to any node
+    outside the square of grid cells within ring cells of (row, col).
+    Sides of the square at the edge of the grid have no nodes beyond them.
+    """
+    lat0, lon0, size = grid["lat0"], grid["lon0"], grid["size"]
+    bounds = []
 
-    for node in nodes:
-        loc2 = (nodes[node]["lat"], nodes[node]["lon"])
+    # nodes above or below the square are at least their difference in
+    # latitude away
+    if row - ring > 0:
+        bounds.append(math.radians(loc[0] - (lat0 + (row - ring) * size)))
+    if row + ring < grid["rows"] - 1:
+        bounds.append(math.radians(lat0 + (row + ring + 1) * size - loc[0]))
 
-        for loc1 in nearest:
-            dist = great_circle_distance(loc1, loc2)
+    # nodes beside it are at least as far as the meridian along that side
+    # (their cross-track distance)
+    for gap, inside in ((loc[1] - (lon0 + (col - ring) * size), col - ring > 0),
+                        (lon0 + (col + ring + 1) * size - loc[1], col + ring < grid["cols"] - 1)):
+        if inside:
+            gap = math.radians(min(max(gap, 0), 90))
+            bounds.append(math.asin(min(math.cos(math.radians(loc[0])) * math.sin(gap), 1)))
 
-            if dist < nearest[loc1]["dist"]:
-                nearest[loc1]["dist"] = dist
-                nearest[loc1]["node"] = node
+    if not bounds:
+        return float("inf")
 
-    return [nearest[loc]["node"] for loc in nearest.keys()]
+    # the same radius as util.great_circle_distance, minus a little to
+    # allow for rounding
+    return max(min(bounds), 0) * 3958 * (1 - 1e-9)
 
 
 def nodes_to_locs(aux_structures, nodes_id):
@@ -284,13 +548,13 @@ def nodes_to_locs(aux_structures, nodes_id):
         list of locations
     """
 
-    nodes, _ = aux_structures
-    locs = [(nodes[n]["lat"], nodes[n]["lon"]) for n in nodes_id]
+    index = aux_structures["index"]
+    locs = [location(aux_structures, index[n]) for n in nodes_id]
 
     return locs
 
 
-def find_path(aux_structures, loc1, loc2, cost_function):
+def find_path(aux_structures, loc1, loc2, cost_function, heuristic=None):
     """
     Return the least costly path between the two locations
 
@@ -300,13 +564,16 @@ def find_path(aux_structures, loc1, loc2, cost_function):
               location
         loc2: tuple of 2 floats: (latitude, longitude), representing the end
               location
+        cost_function: compute_distance or compute_time
+        heuristic: optional lower bound on the cost to the end (see
+                   find_path_nodes)
 
     Returns:
         a list of (latitude, longitude) tuples representing the
         least costly path from loc1 to loc2.
     """
     n1, n2 = nearest_nodes(aux_structures, loc1, loc2)
-    short_path_nodes = find_path_nodes(aux_structures, n1, n2, cost_function)
+    short_path_nodes = find_path_nodes(aux_structures, n1, n2, cost_function, heuristic)
 
     if short_path_nodes is not None:
         short_path_locs = nodes_to_locs(aux_structures, short_path_nodes)
@@ -330,7 +597,7 @@ def find_short_path(aux_structures, loc1, loc2):
         (in terms of distance) from loc1 to loc2.
     """
 
-    return find_path(aux_structures, loc1, loc2, compute_distance)
+    return find_path(aux_structures, loc1, loc2, compute_distance, distance_heuristic)
 
 
 def find_fast_path(aux_structures, loc1, loc2):
@@ -350,7 +617,7 @@ def find_fast_path(aux_structures, loc1, loc2):
         (in terms of time) from loc1 to loc2.
     """
 
-    return find_path(aux_structures, loc1, loc2, compute_time)
+    return find_path(aux_structures, loc1, loc2, compute_time, time_heuristic)
 
 
 if __name__ == '__main__':
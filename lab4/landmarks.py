@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Landmark (ALT: A*, landmarks and the triangle inequality) heuristics over the
+road network built by lab.build_auxiliary_structures.
+
+Preprocessing picks a few landmark nodes spread around the map and stores the
+cost of the cheapest path from every landmark to every node ("forward") and
+from every node to every landmark ("backward").  For any landmark L, the
+triangle inequality gives two lower bounds on the cost from a node v to the
+goal t:
+    cost(v, t) >= cost(L, t) - cost(L, v)
+    cost(v, t) >= cost(v, L) - cost(t, L)
+The heuristic is the largest of these over all landmarks.  Unlike the great
+circle bound, it follows the actual roads and speed limits, so it is much
+tighter, especially when searching by time.
+
+Landmarks are computed for one metric: "distance" (the cost used by
+lab.find_short_path_nodes) or "time" (the one used by lab.find_fast_path).
+
+Example usage:
+    landmarks = build_landmarks(aux, "time", count=16)
+    lab.save_preprocessed(landmarks, 'resources/cambridge.time.alt', aux)
+    path = lab.find_path_nodes(aux, node1, node2, lab.compute_time,
+                               landmark_heuristic(landmarks))
+
+Running this file directly builds and saves landmarks for both metrics of a
+dataset, and compares them with the plain and great circle searches:
+    python3 landmarks.py cambridge 16
+"""
+import sys
+import time
+import heapq
+import random
+from array import array
+
+import lab
+
+
+def reverse_edges(aux, weights):
+    """
+    Return (offsets, targets, weights) arrays of the graph in aux with every
+    edge turned around, laid out like aux["offsets"] and aux["targets"].
+    """
+    offsets, targets = aux["offsets"], aux["targets"]
+    size = len(aux["ids"])
+
+    counts = array("i", [0]) * (size + 1)
+    for j in targets:
+        counts[j + 1] += 1
+    for i in range(size):
+        counts[i + 1] += counts[i]
+
+    reverse_offsets = array("i", counts)
+    reverse_targets = array("i", [0]) * len(targets)
+    reverse_weights = array("d", [0.0]) * len(targets)
+
+    for i in range(size):
+        for k in range(offsets[i], offsets[i + 1]):
+            j = targets[k]
+            reverse_targets[counts[j]] = i
+            reverse_weights[counts[j]] = weights[k]
+            counts[j] += 1
+
+    return reverse_offsets, reverse_targets, reverse_weights
+
+
+def costs_from(offsets, targets, weights, source):
+    """
+    Return an array with the cost of the cheapest path from the node at index
+    source to every node of the graph (inf for nodes it cannot reach).
+    """
+    costs = array("d", [float("inf")]) * (len(offsets) - 1)
+    costs[source] = 0.0
+    agenda = [(0.0, source)]
+
+    while agenda:
+        cost, i = heapq.heappop(agenda)
+        if cost > costs[i]:
+            continue
+
+        for k in range(offsets[i], offsets[i + 1]):
+            new_cost = cost + weights[k]
+            if new_cost < costs[targets[k]]:
+                costs[targets[k]] = new_cost
+                heapq.heappush(agenda, (new_cost, targets[k]))
+
+    return costs
+
+
+def build_landmarks(aux, metric="distance", count=16, seed=6009):
+    """
+    Choose up to count landmarks on the map in aux and compute their costs
+    under the given metric, returning a dictionary with:
+        "metric": the metric
+        "nodes": the number of nodes of the map
+        "landmarks": array of the landmark node indices
+        "forward": list with, per landmark, an array of the cost from the
+                   landmark to every node
+        "backward": list with, per landmark, an array of the cost from every
+                    node to the landmark
+
+    Landmarks are picked by farthest-point selection: the first is the node
+    farthest from a random start, and each next one is the node farthest from
+    all of the landmarks so far, which places them around the edges of the
+    map where they give the best bounds.
+    """
+    size = len(aux["ids"])
+    weights = lab.edge_costs(aux, metric)
+    graph = aux["offsets"], aux["targets"], weights
+    reverse = reverse_edges(aux, weights)
+
+    landmarks = {"metric": metric, "nodes": size, "landmarks": array("i"),
+                 "forward": [], "backward": []}
+    if size == 0:
+        return landmarks
+
+    # cost from the nearest landmark so far to every node
+    nearest = costs_from(*graph, random.Random(seed).randrange(size))
+
+    while len(landmarks["landmarks"]) < count:
+        reachable = [i for i in range(size) if nearest[i] != float("inf")]
+        farthest = max(reachable, key=lambda i: nearest[i])
+        if nearest[farthest] == 0 and landmarks["landmarks"]:
+            break
+
+        forward = costs_from(*graph, farthest)
+        landmarks["landmarks"].append(farthest)
+        landmarks["forward"].append(forward)
+        landmarks["backward"].append(costs_from(*reverse, farthest))
+
+        if len(landmarks["landmarks"]) == 1:
+            nearest = array("d", forward)
+        else:
+            for i in range(size):
+                nearest[i] = min(nearest[i], forward[i])
+
+    return landmarks
+
+
+def landmark_heuristic(landmarks):
+    """
+    Return a heuristic for lab.find_path_nodes (called as
+    heuristic(node, goal, aux)) giving the triangle inequality bound on the
+    cost from node to goal.  Use it with the cost function of the metric the
+    landmarks were built for.
+    """
+    pairs = list(zip(landmarks["forward"], landmarks["backward"]))
+    inf = float("inf")
+    # landmark costs of the goal of the last query
+    goal_costs = [None, []]
+
+    def heuristic(node, goal, aux):
+        index = aux["index"]
+        if goal_costs[0] != goal:
+            t = index[goal]
+            goal_costs[0] = goal
+            goal_costs[1] = [(forward, backward, forward[t], backward[t])
+                             for forward, backward in pairs]
+
+        v = index[node]
+        bound = 0
+        for forward, backward, to_goal, from_goal in goal_costs[1]:
+            # terms involving unreachable nodes are skipped rather than
+            # risking inf - inf
+            if to_goal != inf and forward[v] != inf:
+                bound = max(bound, to_goal - forward[v])
+            if backward[v] != inf and from_goal != inf:
+                bound = max(bound, backward[v] - from_goal)
+
+        return bound
+
+    return heuristic
+
+
+def benchmark(aux, landmarks, queries):
+    """
+    Run the given (node1, node2) queries with no heuristic, with the great
+    circle heuristic and with each set of landmarks (a dictionary mapping
+    metrics to the result of build_landmarks), returning a list of
+    (metric, heuristic name, mean nodes expanded, seconds per query) tuples.
+    """
+    results = []
+
+    for metric, marks in landmarks.items():
+        cost_function, great_circle = lab.metric_functions(metric)
+        heuristics = (("none", None),
+                      ("great circle", great_circle),
+                      ("landmarks", landmark_heuristic(marks)))
+
+        for name, heuristic in heuristics:
+            expanded = 0
+            start = time.time()
+            for node1, node2 in queries:
+                stats = {}
+                lab.find_path_nodes(aux, node1, node2, cost_function, heuristic, stats)
+                expanded += stats.get("expanded", 0)
+            results.append((metric, name, expanded / len(queries),
+                            (time.time() - start) / len(queries)))
+
+    return results
+
+
+if __name__ == '__main__':
+    dataset = sys.argv[1] if len(sys.argv) > 1 else 'cambridge'
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    aux = lab.build_auxiliary_structures(f'resources/{dataset}.nodes', f'resources/{dataset}.ways')
+    landmarks = {}
+
+    for metric in lab.METRICS:
+        start = time.time()
+        landmarks[metric] = build_landmarks(aux, metric, count)
+        lab.save_preprocessed(landmarks[metric], f'resources/{dataset}.{metric}.alt', aux)
+        print('%s: %d landmarks, built in %.1f seconds' % (
+            metric, len(landmarks[metric]["landmarks"]), time.time() - start))
+
+    rng = random.Random(6009)
+    queries = [(rng.choice(aux["ids"]), rng.choice(aux["ids"])) for _ in range(50)]
+    for metric, name, expanded, seconds in benchmark(aux, landmarks, queries):
+        print('%8s, %-12s: %8.1f nodes expanded, %7.2f ms per query' % (
+            metric, name, expanded, seconds * 1000))
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Parallel reader for the locations of nodes in an OSM nodes file (a series of
+pickled dictionaries stacked end-to-end, see util.read_osm_data).
+
+The file is split into byte ranges, one per task, and a pool of worker
+processes reads them at once.  A range rarely starts exactly on a record, so
+each worker first moves forward to the next record boundary: every record of
+a file written with pickle protocol 4 or higher starts with the same three
+bytes (PROTO, the protocol number and FRAME) followed by the 8-byte length of
+the frame holding the rest of the record.  A candidate boundary is only
+accepted if the frame it announces ends in a STOP opcode and is immediately
+followed by another record (or the end of the file).  The ranges that the
+workers actually read must then join up end to end; if they do not (or the
+file uses an older protocol), the file is read serially instead, so the
+result is always the same as reading it with util.read_osm_data.
+
+Workers only unpickle records, check their IDs against a set of wanted
+nodes, and send back the matching IDs and locations as arrays.
+
+Example usage:
+    lat, lon = read_node_locations('resources/cambridge.nodes', index)
+
+Running this file directly times reading a nodes file against the number of
+workers:
+    python3 osm_loader.py cambridge 1 2 4
+"""
+import os
+import sys
+import mmap
+import time
+import pickle
+import multiprocessing
+from array import array
+
+from util import read_osm_data
+
+
+# pickle opcodes used to find record boundaries
+PROTO = 0x80
+FRAME = 0x95
+STOP = ord('.')
+
+# state of each worker process, set up once by _attach
+_filename = None
+_wanted = None
+
+
+def _attach(filename, wanted):
+    """
+    Pool initializer: remember the file to read and the set of wanted node
+    IDs in this worker.
+    """
+    global _filename, _wanted
+    _filename = filename
+    _wanted = wanted
+
+
+def record_header(data):
+    """
+    Return the three bytes every record of the serial pickle file in data
+    starts with, or None if its records are not framed (protocol 3 or lower).
+    """
+    if len(data) >= 3 and data[0] == PROTO and data[1] >= 4 and data[2] == FRAME:
+        return bytes(data[:3])
+
+    return None
+
+
+def record_end(data, header, p):
+    """
+    Return the position just after the record starting at position p of
+    data, or None if no valid record starts there.
+    """
+    if data[p:p + 3] != header:
+        return None
+
+    end = p + 11 + int.from_bytes(data[p + 3:p + 11], 'little')
+    if end > len(data) or data[end - 1] != STOP:
+        return None
+    if end < len(data) and data[end:end + 3] != header:
+        return None
+
+    return end
+
+
+def next_record(data, header, p):
+    """
+    Return the position of the first record boundary at or after position p
+    of data (len(data) if there is none).
+    """
+    while True:
+        p = data.find(header, p)
+        if p == -1:
+            return len(data)
+        if record_end(data, header, p) is not None:
+            return p
+        p += 1
+
+
+def read_range(data, header, wanted, start, end):
+    """
+    Read the records of data starting in the byte range start..end - 1.
+
+    Returns a tuple (first, stop, ids, lat, lon): the positions of the first
+    record read and of the first record after the range, and arrays with the
+    ID and location of every node read whose ID is in wanted.
+    """
+    ids = array('q')
+    lat = array('d')
+    lon = array('d')
+
+    first = p = next_record(data, header, start)
+
+    while p < end:
+        stop = record_end(data, header, p)
+        if stop is None:
+            # not a record boundary after all; the caller will notice the gap
+            break
+
+        node = pickle.loads(data[p:stop])
+        if node["id"] in wanted:
+            ids.append(node["id"])
+            lat.append(node["lat"])
+            lon.append(node["lon"])
+        p = stop
+
+    return first, p, ids, lat, lon
+
+
+def _read_chunk(bounds):
+    """
+    Worker task: read one byte range of the file.
+    """
+    with open(_filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return read_range(data, record_header(data), _wanted, *bounds)
+
+
+def read_node_locations(filename, index, workers=1, chunk_size=1 << 22, context=None):
+    """
+    Return arrays (lat, lon) with the location of every node in the given
+    nodes file whose ID is a key of index, at position index[node ID].
+    Nodes that are not in the file get a location of nan.
+
+    With more than one worker (None means one per CPU), the file is read in
+    byte ranges of about chunk_size bytes by a pool of that many processes,
+    started from the given multiprocessing context (or the default one).
+    Under the "spawn" and "forkserver" start methods every worker imports the
+    main module again, so a script asking for workers must do so behind an
+    if __name__ == '__main__' guard.
+
+    With a single worker, or a file that fits in one range, the file is
+    streamed through util.read_osm_data in this process, which is faster than
+    finding the record boundaries.
+    """
+    lat = array('d', [float('nan')]) * len(index)
+    lon = array('d', [float('nan')]) * len(index)
+    workers = workers or os.cpu_count() or 1
+
+    size = os.path.getsize(filename)
+    with open(filename, 'rb') as f:
+        header = record_header(f.read(3))
+
+    count = -(-size // chunk_size)
+    chunks = None
+
+    if header is not None and workers > 1 and count > 1:
+        bounds = [(size * k // count, size * (k + 1) // count) for k in range(count)]
+
+        context = context or multiprocessing
+        with context.Pool(min(workers, count), initializer=_attach,
+                          initargs=(filename, set(index))) as pool:
+            chunks = pool.map(_read_chunk, bounds)
+
+        # every range that read anything must have started exactly where the
+        # one before it stopped, and read up to its end
+        expected = 0
+        for (_, end), (first, stop, _, _, _) in zip(bounds, chunks):
+            if first < end:
+                if first != expected or stop < end:
+                    break
+                expected = stop
+        if expected != size:
+            chunks = None
+
+    if chunks is None:
+        for node in read_osm_data(filename):
+            i = index.get(node["id"])
+            if i is not None:
+                lat[i] = node["lat"]
+                lon[i] = node["lon"]
+        return lat, lon
+
+    for _, _, ids, chunk_lat, chunk_lon in chunks:
+        for node, y, x in zip(ids, chunk_lat, chunk_lon):
+            i = index[node]
+            lat[i] = y
+            lon[i] = x
+
+    return lat, lon
+
+
+def benchmark(filename, index, worker_counts):
+    """
+    Time reading the given nodes file once per entry of worker_counts,
+    returning a list of (workers, seconds) tuples.  Reading it serially with
+    util.read_osm_data is reported as 0 workers.
+    """
+    results = []
+
+    for workers in worker_counts:
+        start = time.time()
+        if workers == 0:
+            for node in read_osm_data(filename):
+                index.get(node["id"])
+        else:
+            read_node_locations(filename, index, workers)
+        results.append((workers, time.time() - start))
+
+    return results
+
+
+if __name__ == '__main__':
+    dataset = sys.argv[1] if len(sys.argv) > 1 else 'cambridge'
+    counts = [int(i) for i in sys.argv[2:]] or [0, 1, 2, 4, 8]
+
+    # the nodes on some way, as build_auxiliary_structures finds them
+    index = {}
+    for way in read_osm_data(f'resources/{dataset}.ways'):
+        for node in way["nodes"]:
+            index.setdefault(node, len(index))
+
+    filename = f'resources/{dataset}.nodes'
+    print('%s: %d bytes, %d wanted nodes' % (filename, os.path.getsize(filename), len(index)))
+    for workers, seconds in benchmark(filename, index, counts):
+        print('%2d workers: %6.2f seconds' % (workers, seconds))
@@ -39,10 +39,9 @@ except:
     center_point = 42.3751, -71.1053
 
 
-print('building auxiliary structures...')
-t = time.time()
-AUX = build_auxiliary_structures(nodes_filename, ways_filename)
-print('auxiliary structures built in %.02f seconds.' % (time.time() - t,))
+# built when this file is run as the server, so that the processes loading
+# the map in parallel do not build it again when they import this module
+AUX = None
 
 with open(os.path.join(app_root, 'index.html'), 'rb') as f:
     index_contents = f.read() % center_point
@@ -105,6 +104,11 @@ def application(environ, start_response):
 
 
 if __name__ == '__main__':
+    print('building auxiliary structures...')
+    t = time.time()
+    AUX = build_auxiliary_structures(nodes_filename, ways_filename, workers=None)
+    print('auxiliary structures built in %.02f seconds.' % (time.time() - t,))
+
     print('starting server.  navigate to http://localhost:6009/')
     with make_server('', 6009, application) as httpd:
         try:
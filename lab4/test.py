@@ -1,9 +1,12 @@
 #!/usr/bin/env python3
 import os
 import pickle
+import random
+import multiprocessing
 
 import lab
 import pytest
+from util import great_circle_distance
 
 TEST_DIRECTORY = os.path.dirname(__file__)
 
@@ -275,6 +278,155 @@ def test_cambridge_fast(testcase):
 
 # Custom tests
 
+def make_grid_dataset(directory, size=12, seed=6009):
+    """
+    Write a size x size grid of streets with random speed limits and
+    one-ways to directory, and return its auxiliary structures along with
+    the IDs of its nodes.
+    """
+    rng = random.Random(seed)
+    ids = {(r, c): 1000 + r * size + c for r in range(size) for c in range(size)}
+    nodes = [{'id': i, 'lat': 42.35 + r * 0.002 + rng.uniform(-5e-4, 5e-4),
+              'lon': -71.1 + c * 0.0025 + rng.uniform(-5e-4, 5e-4), 'tags': {}}
+             for (r, c), i in ids.items()]
+    ways = []
+    for k in range(size):
+        for line in ([ids[k, c] for c in range(size)], [ids[r, k] for r in range(size)]):
+            tags = {'highway': rng.choice(['primary', 'residential', 'living_street'])}
+            if rng.random() < 0.3:
+                tags['oneway'] = 'yes'
+            if rng.random() < 0.3:
+                tags['maxspeed_mph'] = rng.choice([15, 40, 55])
+            ways.append({'id': len(ways), 'nodes': line, 'tags': tags})
+
+    for name, elements in (('grid.nodes', nodes), ('grid.ways', ways)):
+        with open(os.path.join(directory, name), 'wb') as f:
+            for element in elements:
+                pickle.dump(element, f)
+
+    aux = lab.build_auxiliary_structures(os.path.join(directory, 'grid.nodes'),
+                                         os.path.join(directory, 'grid.ways'))
+    return aux, sorted(ids.values())
+
+
+def test_astar_matches_uniform_cost(tmp_path):
+    aux, ids = make_grid_dataset(tmp_path)
+    rng = random.Random(6009)
+    for _ in range(20):
+        start, end = rng.choice(ids), rng.choice(ids)
+        for cost, heuristic in ((lab.compute_distance, lab.distance_heuristic),
+                                (lab.compute_time, lab.time_heuristic)):
+            plain, informed = {}, {}
+            expected = lab.find_path_nodes(aux, start, end, cost, stats=plain)
+            result = lab.find_path_nodes(aux, start, end, cost, heuristic, informed)
+            assert result == expected
+            assert informed['expanded'] <= plain['expanded']
+
+
+def test_nearest_nodes_grid(tmp_path):
+    aux, ids = make_grid_dataset(tmp_path)
+    nodes = lab.nodes_to_locs(aux, ids)
+    rng = random.Random(6009)
+    # points inside, around and far outside the map
+    locs = nodes[:20] + [(42.35 + rng.uniform(-0.05, 0.07), -71.1 + rng.uniform(-0.05, 0.08))
+                        for _ in range(100)] + [(0, 0), (60, -71.1), (42.36, 100)]
+    for loc in locs:
+        expected = min(zip(ids, nodes), key=lambda i: great_circle_distance(loc, i[1]))[0]
+        assert lab.nearest_nodes(aux, loc) == [expected]
+
+
+def test_contraction_hierarchy(tmp_path):
+    import contraction
+    aux, ids = make_grid_dataset(tmp_path)
+    rng = random.Random(6009)
+    queries = [(rng.choice(ids), rng.choice(ids)) for _ in range(30)] + [(ids[0], ids[0])]
+    for metric in lab.METRICS:
+        cost, _ = lab.metric_functions(metric)
+        lab.save_preprocessed(contraction.build_hierarchy(aux, metric), tmp_path / 'grid.ch', aux)
+        hierarchy = lab.load_preprocessed(tmp_path / 'grid.ch', aux)
+        for start, end in queries:
+            expected = lab.find_path_nodes(aux, start, end, cost)
+            assert contraction.hierarchy_path_nodes(aux, hierarchy, start, end) == expected
+
+    # a map downloaded again with the same nodes but different ways
+    changed, _ = make_grid_dataset(tmp_path, seed=1)
+    assert len(changed['ids']) == len(aux['ids'])
+    with pytest.raises(ValueError):
+        lab.load_preprocessed(tmp_path / 'grid.ch', changed)
+
+
+def test_landmark_heuristic(tmp_path):
+    import landmarks
+    aux, ids = make_grid_dataset(tmp_path)
+    rng = random.Random(6009)
+    queries = [(rng.choice(ids), rng.choice(ids)) for _ in range(30)] + [(ids[0], ids[0])]
+    for metric in lab.METRICS:
+        cost, _ = lab.metric_functions(metric)
+        lab.save_preprocessed(landmarks.build_landmarks(aux, metric, 4), tmp_path / 'grid.alt', aux)
+        heuristic = landmarks.landmark_heuristic(lab.load_preprocessed(tmp_path / 'grid.alt', aux))
+        plain, guided = 0, 0
+        for start, end in queries:
+            stats = {}
+            expected = lab.find_path_nodes(aux, start, end, cost, stats=stats)
+            plain += stats["expanded"]
+            assert lab.find_path_nodes(aux, start, end, cost, heuristic, stats) == expected
+            guided += stats["expanded"]
+        assert guided < plain
+
+    with pytest.raises(ValueError):
+        landmarks.build_landmarks(aux, 'walking')
+    small, _ = make_grid_dataset(tmp_path, size=3)
+    with pytest.raises(ValueError):
+        lab.load_preprocessed(tmp_path / 'grid.alt', small)
+
+
+def test_parallel_node_loader(tmp_path):
+    import osm_loader
+    aux, ids = make_grid_dataset(tmp_path)
+    nodes = os.path.join(tmp_path, 'grid.nodes')
+    index = dict(aux['index'])
+    expected = osm_loader.read_node_locations(nodes, index, workers=1)
+    assert expected == (aux['lat'], aux['lon'])
+    for chunk_size in (97, 500, 4096):
+        assert osm_loader.read_node_locations(nodes, index, 2, chunk_size) == expected
+
+    # workers started by importing the modules again, rather than forking
+    spawn = multiprocessing.get_context('spawn')
+    assert osm_loader.read_node_locations(nodes, index, 2, 500, spawn) == expected
+
+    # files written with an older pickle protocol are read serially
+    with open(os.path.join(tmp_path, 'old.nodes'), 'wb') as f:
+        for node in lab.read_osm_data(nodes):
+            pickle.dump(node, f, protocol=2)
+    assert osm_loader.read_node_locations(os.path.join(tmp_path, 'old.nodes'),
+                                          index, 2, 97) == expected
+
+    # nodes missing from the file are left without a location
+    lat, lon = osm_loader.read_node_locations(nodes, {1: 0, ids[0]: 1}, 2, 97)
+    assert lat[0] != lat[0] and lon[1] == expected[1][index[ids[0]]]
+
+    parallel = lab.build_auxiliary_structures(nodes, os.path.join(tmp_path, 'grid.ways'), 2)
+    for key in ('ids', 'lat', 'lon', 'targets', 'distances'):
+        assert parallel[key] == aux[key]
+
+
+def test_way_through_node_twice(tmp_path):
+    # a one-way loop 1 -> 2 -> 3 -> 1 -> 4 leaves node 1 towards both 2 and 4
+    nodes = [{'id': i, 'lat': 42.36 + i * 1e-3, 'lon': -71.09 - (i % 2) * 1e-3, 'tags': {}}
+             for i in range(1, 5)]
+    ways = [{'id': 1, 'nodes': [1, 2, 3, 1, 4], 'tags': {'highway': 'residential', 'oneway': 'yes'}},
+            {'id': 2, 'nodes': [1, 2], 'tags': {'highway': 'primary'}}]
+    for name, elements in (('loop.nodes', nodes), ('loop.ways', ways)):
+        with open(tmp_path / name, 'wb') as f:
+            for element in elements:
+                pickle.dump(element, f)
+    aux = lab.build_auxiliary_structures(tmp_path / 'loop.nodes', tmp_path / 'loop.ways')
+
+    # the faster of the two ways between 1 and 2 is used
+    assert lab.get_children(1, aux) == {2: 35, 4: 25}
+    assert lab.get_children(2, aux) == {3: 25, 1: 35}
+    assert lab.find_short_path_nodes(aux, 1, 4) == [1, 4]
+    assert lab.find_short_path_nodes(aux, 4, 1) is None
 
 if __name__ == '__main__':
     import sys